@@ -0,0 +1,153 @@
+# accesslog.py
+
+# Structured JSON access log that stays off the request latency path.
+# The request thread only builds a small dict and drops it into a bounded
+# in-memory queue (QueueHandler); a QueueListener thread serializes and
+# writes the lines. If the writer falls behind, records are dropped and
+# counted instead of blocking requests.
+#
+# Each line carries:
+#   ts, method, route (endpoint), site, status, latency_ms,
+#   user (salted hash of the user_id, never the raw id), mongo_ops
+# Successful responses (status < 400) can be sampled with
+# access_log_sample_rate; errors are always logged.
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+
+from flask import g, request
+from pymongo import monitoring
+
+logger = logging.getLogger("gormazar.access")
+
+
+# -------------------------------------------------------------------
+# Mongo operation counter
+# CommandListener callbacks run on the thread that issues the command,
+# so a thread-local counter reset at the start of each request gives the
+# number of Mongo commands that request sent.
+# -------------------------------------------------------------------
+class MongoOpCounter(monitoring.CommandListener):
+    def __init__(self):
+        self._local = threading.local()
+
+    def reset(self):
+        self._local.count = 0
+
+    def value(self):
+        return getattr(self._local, "count", 0)
+
+    def started(self, event):
+        self._local.count = getattr(self._local, "count", 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# -------------------------------------------------------------------
+# Queue plumbing
+# -------------------------------------------------------------------
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Serialization happens in the listener thread, not here
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JSONLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, separators=(",", ":"), default=str)
+
+
+def hash_user(user_id, salt):
+    if not user_id:
+        return None
+    return hashlib.blake2b(user_id.encode("utf-8"), digest_size=8, key=salt).hexdigest()
+
+
+class AccessLog:
+    def __init__(self, destination, sample_rate=1.0, queue_size=10000, salt=""):
+        self.sample_rate = sample_rate
+        self.salt = salt.encode("utf-8")[:64]
+        self.op_counter = MongoOpCounter()
+
+        if destination == "-":
+            writer = logging.StreamHandler(sys.stdout)
+        else:
+            writer = logging.FileHandler(destination, encoding="utf-8")
+        writer.setFormatter(JSONLineFormatter())
+
+        self.handler = DroppingQueueHandler(queue_size)
+        self.listener = logging.handlers.QueueListener(self.handler.queue, writer)
+        logger.addHandler(self.handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+
+    # ---------------------------------------------------------------
+    # Request hooks
+    # ---------------------------------------------------------------
+    def before_request(self):
+        g.access_start = time.perf_counter()
+        self.op_counter.reset()
+
+    def after_request(self, response):
+        g.access_status = response.status_code
+        return response
+
+    def teardown_request(self, exc):
+        # before_request is skipped when the site lookup aborts the request
+        start = g.pop("access_start", None)
+        # Unhandled exceptions never reach after_request
+        status = g.pop("access_status", 500)
+        if status < 400 and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+
+        user_id = (request.view_args or {}).get("user_id")
+        if user_id is None and "form" in request.__dict__:
+            # Only look at the form if the route already parsed it
+            user_id = request.form.get("user_id")
+        site = g.get("site")
+
+        logger.info({
+            "ts": round(time.time(), 3),
+            "method": request.method,
+            "route": request.endpoint,
+            "site": site.id if site is not None else None,
+            "status": status,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 3) if start else None,
+            "user": hash_user(user_id, self.salt),
+            "mongo_ops": self.op_counter.value() if start else 0,
+        })
+
+
+def init_app(app, access_log):
+    access_log.start()
+    app.before_request(access_log.before_request)
+    app.after_request(access_log.after_request)
+    app.teardown_request(access_log.teardown_request)
+    # The JSON access log replaces Werkzeug's per-request text lines
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
@@ -0,0 +1,24 @@
+# admin.py
+
+# Protection for operator-only endpoints. They are enabled by setting
+# admin_token (env ADMIN_TOKEN) and called with
+#   Authorization: Bearer <admin_token>
+# Without a configured token every admin endpoint answers 404, so nothing
+# is exposed by default.
+import functools
+import hmac
+
+from flask import abort, current_app, request
+
+
+def admin_required(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.extensions["gormazar.settings"].admin_token
+        if not token:
+            abort(404)
+        scheme, _, supplied = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(supplied.encode(), token.encode()):
+            abort(401)
+        return view(*args, **kwargs)
+    return wrapper
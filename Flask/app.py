@@ -2,45 +2,79 @@
 
 # Flask application providing a REST API for the Gormaz AR project.
 # It manages user registration, graffiti scan increments, and session statistics.
-from flask import Flask, jsonify, request
+import time
+
+from flask import Flask, abort, g, jsonify, request
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import accesslog
+import assets
+import fastjson
+import health
+import loadgen
+import metrics
+import profiler
+import ratelimit
+import retention
+import sessions
+import singleflight
+import settings as config
+import sites
+import slowops
+import transfer
+import uniques
+import userquery
 
 app = Flask(__name__)
 CORS(app)  # Enable Cross-Origin Resource Sharing for all routes
+fastjson.init_app(app)  # orjson-backed app.json when orjson is installed
 
 # -------------------------------------------------------------------
 # Database setup
 # -------------------------------------------------------------------
 
-# Connect to local MongoDB instance
-client = MongoClient('mongodb://localhost:27017/')
-db = client['GormazAR']
+# Load deployment settings (defaults, GORMAZAR_CONFIG file, environment)
+settings = config.load()
+config.init_app(app, settings)
 
-# Collections for graffiti data, users, and global statistics
-images_col = db['graffiti']
-users_col  = db['users']
-stats_col  = db['stats']
+# /healthz and /readyz; readiness pings Mongo at most once per
+# health_ping_seconds and reports connection-pool usage
+health_monitor = health.HealthMonitor(
+    settings.health_ping_seconds,
+    settings.health_ping_timeout_ms,
+    max_pool_size=settings.mongo_max_pool_size
+)
+health.init_app(app, health_monitor)
+listeners = [health_monitor]
 
-# -------------------------------------------------------------------
-# Initialize global statistics document if it does not exist
-# Tracks:
-#   - unique_users: how many distinct devices have registered
-#   - users_completed: how many users have scanned all graffiti
-#   - sessions_count: total number of sessions ended
-#   - average_session_time: running average of session durations
-# -------------------------------------------------------------------
-if stats_col.count_documents({"_id": "global"}) == 0:
-    stats_col.insert_one({
-        "_id": "global",
-        "unique_users": 0,
-        "users_completed": 0,
-        "sessions_count": 0,
-        "average_session_time": 0.0
-    })
+# Structured JSON access log written from a background thread
+# (access_log: "-" for stdout, a file path, or empty to disable)
+if settings.access_log:
+    access_log = accesslog.AccessLog(
+        settings.access_log,
+        sample_rate=settings.access_log_sample_rate,
+        queue_size=settings.access_log_queue_size,
+        salt=settings.access_log_salt
+    )
+    accesslog.init_app(app, access_log)
+    listeners.append(access_log.op_counter)
+
+# Log Mongo commands slower than slow_op_ms (negative disables), with a
+# rate-limited explain plan per query shape
+if settings.slow_op_ms >= 0:
+    slow_op_recorder = slowops.SlowOpRecorder(settings.slow_op_ms, settings.slow_op_explain_seconds)
+    slowops.init_app(app, slow_op_recorder)
+    listeners.append(slow_op_recorder)
+
+# Connect to the configured MongoDB instance (local by default)
+client = MongoClient(settings.mongo_uri, event_listeners=listeners, **settings.client_options())
+for listener in listeners:
+    listener.client = client
 
 # -------------------------------------------------------------------
-# Ensure initial graffiti documents exist
+# Initial graffiti of the default site (Gormaz castle)
 # Each doc has:
 #   id      – identifier matching the AR reference image name
 #   name    – human-readable description
@@ -51,83 +85,301 @@ initial_docs = [
     {"id": "irlDate",    "name": "Gothic inscription in north wall", "scans": 0},
     {"id": "irlMonk",    "name": "Pointing monk in hastial", "scans": 0}
 ]
-for doc in initial_docs:
-    if images_col.count_documents({"id": doc["id"]}, limit=1) == 0:
-        images_col.insert_one(doc)
+
+# -------------------------------------------------------------------
+# Sites
+# Every heritage site has its own database (graffiti, users, stats,
+# users_archive). The default site answers the unprefixed routes and
+# every site, default included, is also reachable under
+# /sites/<site_id>/. Stats documents, initial graffiti and indexes are
+# created per site at startup.
+# -------------------------------------------------------------------
+site_registry = sites.SiteRegistry(client, settings, initial_docs)
+site_registry.ensure_initialized()
+sites.init_app(app, site_registry)
+
+@app.url_value_preprocessor
+def pull_site(endpoint, values):
+    site_id = values.pop("site_id", None) if values else None
+    g.site = site_registry.get(site_id) if site_id else site_registry.default
+    if g.site is None:
+        abort(404)
+
+# -------------------------------------------------------------------
+# Rate limiting
+# Per user_id and per remote address, per route (rate_limits). Counters
+# live in process memory, or in the default database when
+# rate_limit_backend is "mongo" so every worker shares them.
+# -------------------------------------------------------------------
+if settings.rate_limit_backend == "mongo":
+    limiter_backend = ratelimit.MongoBackend(
+        settings.bind(client[settings.mongo_database][ratelimit.RATE_LIMIT_COLLECTION], "scan")
+    )
+    limiter_backend.ensure_indexes()
+elif settings.rate_limit_backend == "memory":
+    limiter_backend = ratelimit.MemoryBackend(settings.rate_limit_max_keys)
+else:
+    raise ValueError(f"Unknown rate_limit_backend: {settings.rate_limit_backend!r}")
+ratelimit.init_app(app, ratelimit.RateLimiter(settings.rate_limits, limiter_backend))
+
+# Per-key metrics of coalesced reads: GET /admin/singleflight
+singleflight.init_app(app, site_registry)
+
+# Support lookups with keyset pagination: GET /admin/users
+userquery.init_app(app)
+
+# Register the export-data / import-data CLI commands
+transfer.init_app(app)
+
+# Register the archive-users CLI command and, when archive_after_days is
+# set, start a background archiver per site for inactive users
+retention.init_app(
+    app, site_registry,
+    max_age_days=settings.archive_after_days,
+    interval=settings.archive_interval_seconds,
+    batch_size=settings.archive_batch_size
+)
+
+# Tracked sessions with buffered heartbeats, a stale-session sweeper per
+# site and the /stats/live gauge
+sessions.init_app(
+    app, site_registry,
+    heartbeat_interval=settings.session_heartbeat_seconds,
+    flush_interval=settings.session_flush_seconds,
+    sweep_interval=settings.session_sweep_seconds
+)
+
+# When record_trace_path is set, append every request to an NDJSON trace
+# that loadgen.py can replay against another server
+loadgen.init_recorder(app, settings.record_trace_path)
+
+# Opt-in sampling profiler: POST /admin/profile, SIGUSR2, or per-route
+# request sampling through profile_request_rates
+profiler.init_app(
+    app, settings.profile_dir,
+    hz=settings.profile_hz,
+    request_rates={k: float(v) for k, v in settings.profile_request_rates.items()},
+    signal_seconds=settings.profile_signal_seconds
+)
+
+# -------------------------------------------------------------------
+# Asset delivery
+# Reference images and overlays are served by content hash from each
+# site's assets directory, listed per graffiti in /assets/manifest
+# -------------------------------------------------------------------
+assets.init_app(app, lambda: g.site.assets)
+
+# Daily / per-graffiti unique visitors: GET /stats/uniques
+uniques.init_app(app, lambda: g.site.uniques)
+
+# -------------------------------------------------------------------
+# Constant responses, serialized once at startup
+# -------------------------------------------------------------------
+WELCOME            = fastjson.static_response(app, {"message": "Welcome to GormazAR's API"}, 200)
+ALREADY_REGISTERED = fastjson.static_response(app, {"message": "User already registered"}, 200)
+MISSING_USER_ID    = fastjson.static_response(app, {"error": "Missing user_id in request."}, 400)
+UNKNOWN_USER       = fastjson.static_response(app, {"error": "Unknown user_id; register first."}, 404)
+MISSING_DURATION   = fastjson.static_response(app, {"error": "Missing 'duration' field."}, 400)
+INVALID_DURATION   = fastjson.static_response(app, {"error": "Invalid 'duration' value."}, 400)
 
 # -------------------------------------------------------------------
 # Route: Home
 # Returns a welcome message
 # -------------------------------------------------------------------
 @app.route('/')
+@app.route('/sites/<site_id>/')
 def home():
-    return jsonify({"message": "Welcome to GormazAR's API"}), 200
+    return WELCOME()
+
+# -------------------------------------------------------------------
+# Route: Global Statistics
+# GET /stats
+# Returns the global statistics document. Uses the "stats" operation
+# class, so it may be served by a secondary when configured.
+# Concurrent requests in a worker share one read.
+# -------------------------------------------------------------------
+@app.route('/stats', methods=['GET'])
+@app.route('/sites/<site_id>/stats', methods=['GET'])
+def get_stats():
+    return jsonify(g.site.stats() or {}), 200
+
+# -------------------------------------------------------------------
+# New users
+# Upserts on the unique user_id index, so a device is inserted once even
+# when client retries overlap. Returns True only for the request that
+# inserted it.
+# -------------------------------------------------------------------
+def create_user(users, user_id, now):
+    try:
+        result = users.update_one(
+            {"user_id": user_id},
+            {
+                "$set": {"last_seen": now},    # last activity, used for archiving
+                "$setOnInsert": {
+                    "scanned": [],             # list of graffiti IDs scanned by this user
+                    "completed": False,        # flag marking if user scanned all graffiti
+                    "created_at": now
+                }
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False  # a concurrent request inserted it first
+    return result.upserted_id is not None
 
 # -------------------------------------------------------------------
 # Route: Register User
 # POST /registerUser/<user_id>
 # Registers a new user/device if not already present.
 # Increments unique_users if this is a new registration.
+# Known users get their last_seen refreshed; archived users are moved
+# back into the hot collection without being counted again.
 # -------------------------------------------------------------------
 @app.route('/registerUser/<user_id>', methods=['POST'])
+@app.route('/sites/<site_id>/registerUser/<user_id>', methods=['POST'])
 def register_user(user_id):
-    # Only insert if the user_id is new
-    if not users_col.find_one({"user_id": user_id}):
-        users_col.insert_one({
-            "user_id": user_id,
-            "scanned": [],      # list of graffiti IDs scanned by this user
-            "completed": False  # flag marking if user scanned all graffiti
-        })
+    users   = g.site.col("users", "registration")
+    archive = g.site.col("archive", "registration")
+    stats   = g.site.col("stats", "registration")
+
+    now = retention.utcnow()
+    known = users.update_one(
+        {"user_id": user_id},
+        {"$set": {"last_seen": now}}
+    ).matched_count
+    if not known:
+        known = retention.restore_user(users, archive, user_id)
+
+    # Count today's visit in the unique-visitor sketches
+    g.site.uniques.record(user_id)
+
+    # Only insert if the user_id is new; with overlapping requests for
+    # the same device, only the one that inserts counts the user
+    if not known and create_user(users, user_id, now):
         # Update global unique_users count
-        stats_col.update_one(
+        stats.update_one(
             {"_id": "global"},
             {"$inc": {"unique_users": 1}}
         )
         return jsonify({"message": f"User {user_id} successfully registered"}), 201
 
     # User was already registered
-    return jsonify({"message": "User already registered"}), 200
+    return ALREADY_REGISTERED()
+
+# -------------------------------------------------------------------
+# Route: Bootstrap Session
+# POST /bootstrap/<user_id>
+# Everything the client needs at launch in one round trip: registers
+# the user if new (idempotent, like /registerUser) and returns the
+# user's scanned graffiti, completion flag, the site catalog and the
+# global statistics.
+# A returning user costs two Mongo operations (refresh last_seen while
+# reading progress, read stats), a new one four (plus the archive
+# lookup and the upsert; counting replaces the stats read). Either may
+# add one unique-visitor sketch write, skipped when this worker already
+# wrote that register today. The catalog comes from the site cache.
+# -------------------------------------------------------------------
+@app.route('/bootstrap/<user_id>', methods=['POST'])
+@app.route('/sites/<site_id>/bootstrap/<user_id>', methods=['POST'])
+def bootstrap(user_id):
+    users   = g.site.col("users", "registration")
+    archive = g.site.col("archive", "registration")
+    progress = {"_id": 0, "scanned": 1, "completed": 1}
+
+    now = retention.utcnow()
+    user = users.find_one_and_update(
+        {"user_id": user_id},
+        {"$set": {"last_seen": now}},
+        projection=progress,
+        return_document=ReturnDocument.AFTER
+    )
+    if user is None and retention.restore_user(users, archive, user_id):
+        user = users.find_one({"user_id": user_id}, progress)
+
+    g.site.uniques.record(user_id)
+
+    registered = False
+    if user is None:
+        user = {"scanned": [], "completed": False}
+        registered = create_user(users, user_id, now)
+    if registered:
+        # Count the new user and read the stats in the same operation
+        stats = g.site.col("stats", "registration").find_one_and_update(
+            {"_id": "global"},
+            {"$inc": {"unique_users": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    else:
+        stats = g.site.stats()
+
+    return jsonify({
+        "user_id":    user_id,
+        "registered": registered,
+        "scanned":    user.get("scanned", []),
+        "completed":  user.get("completed", False),
+        "catalog":    g.site.catalog(),
+        "stats":      stats or {}
+    }), 201 if registered else 200
 
 # -------------------------------------------------------------------
 # Route: Increment Scan Counter
 # POST /increment/<doc_id>
 # Increments the scan count for a graffiti document (doc_id),
 # records the scan under the given user_id, and flags completion when
-# user scans all three.
+# user has scanned every graffiti of the site.
+# Unknown users get a 404 before anything is counted.
 # -------------------------------------------------------------------
 @app.route('/increment/<doc_id>', methods=['POST'])
+@app.route('/sites/<site_id>/increment/<doc_id>', methods=['POST'])
 def increment_counter(doc_id):
     user_id = request.form.get("user_id")
     if not user_id:
-        return jsonify({"error": "Missing user_id in request."}), 400
+        return MISSING_USER_ID()
+
+    images = g.site.col("images", "scan")
+    users  = g.site.col("users", "scan")
+
+    # Make sure the user exists, restoring it from the archive if needed
+    touch = {"$set": {"last_seen": retention.utcnow()}}
+    if users.update_one({"user_id": user_id}, touch).matched_count == 0:
+        archive = g.site.col("archive", "registration")
+        if not retention.restore_user(g.site.col("users", "registration"), archive, user_id):
+            return UNKNOWN_USER()
 
     # Increment the scans counter on the graffiti document
-    result = images_col.update_one(
+    result = images.update_one(
         {"id": doc_id},
         {"$inc": {"scans": 1}}
     )
     if result.modified_count == 0:
         return jsonify({"error": f"Could not increment scans for {doc_id}"}), 400
 
-    # Retrieve updated graffiti document
-    doc = images_col.find_one({"id": doc_id})
+    # Retrieve updated graffiti document; concurrent scans of the same
+    # graffiti share one read that started after this increment
+    doc = g.site.graffiti(doc_id, not_before=time.monotonic())
 
     # Add this doc_id to user's scanned list if not already present
-    users_col.update_one(
+    user = users.find_one_and_update(
         {"user_id": user_id},
-        {"$addToSet": {"scanned": doc_id}}
+        {"$addToSet": {"scanned": doc_id}},
+        projection={"_id": 0, "scanned": 1, "completed": 1},
+        return_document=ReturnDocument.AFTER
     )
+    if user is None:
+        return UNKNOWN_USER()  # archived since the check above
 
-    # Check if user has now scanned all three graffiti
-    user = users_col.find_one({"user_id": user_id})
+    g.site.uniques.record(user_id, graffiti=doc_id)
+
+    # Check if user has now scanned all graffiti of the site
     scanned = user.get("scanned", [])
-    if len(scanned) == 3 and not user.get("completed", False):
+    if len(scanned) >= len(g.site.catalog()) and not user.get("completed", False):
         # Mark user as completed and update global counter
-        users_col.update_one(
+        g.site.col("users", "completion").update_one(
             {"user_id": user_id},
             {"$set": {"completed": True}}
         )
-        stats_col.update_one(
+        g.site.col("stats", "completion").update_one(
             {"_id": "global"},
             {"$inc": {"users_completed": 1}}
         )
@@ -144,34 +396,27 @@ def increment_counter(doc_id):
 # POST /endSession/<user_id>
 # Receives the session duration, updates global session count and
 # running average session time.
+# Clients sending heartbeats use /session/end/<session_id> instead.
 # -------------------------------------------------------------------
 @app.route('/endSession/<user_id>', methods=['POST'])
+@app.route('/sites/<site_id>/endSession/<user_id>', methods=['POST'])
 def end_session(user_id):
     # Parse duration from form data
     duration = request.form.get("duration")
     if duration is None:
-        return jsonify({"error": "Missing 'duration' field."}), 400
+        return MISSING_DURATION()
     try:
         duration = float(duration)
     except ValueError:
-        return jsonify({"error": "Invalid 'duration' value."}), 400
-
-    # Retrieve current stats
-    stats = stats_col.find_one({"_id": "global"})
-    current_count = stats.get("sessions_count", 0)
-    current_avg   = stats.get("average_session_time", 0.0)
-
-    # Compute new running average
-    new_count = current_count + 1
-    new_avg   = (current_avg * current_count + duration) / new_count
-
-    # Update stats collection
-    stats_col.update_one(
-        {"_id": "global"},
-        {"$set": {
-            "sessions_count": new_count,
-            "average_session_time": new_avg
-        }}
+        return INVALID_DURATION()
+
+    # Update session count and running average in one atomic operation
+    new_avg = sessions.record_durations(g.site.col("stats", "session"), duration)
+
+    # Record user activity
+    g.site.col("users", "session").update_one(
+        {"user_id": user_id},
+        {"$set": {"last_seen": retention.utcnow()}}
     )
 
     # Return updated session info
@@ -180,6 +425,14 @@ def end_session(user_id):
         "average_session_time": new_avg
     }), 200
 
+# -------------------------------------------------------------------
+# Cross-worker request metrics: GET /metrics
+# Registered after every route so each endpoint gets its own series.
+# Empty metrics_dir disables them.
+# -------------------------------------------------------------------
+if settings.metrics_dir:
+    metrics.init_app(app, metrics.MetricsStore(settings.metrics_dir, settings.metrics_rows))
+
 # -------------------------------------------------------------------
 # Application entry point
 # Runs the Flask server on all interfaces at port 5000 in debug mode
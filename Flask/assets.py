@@ -0,0 +1,174 @@
+# assets.py
+
+# Content-addressed delivery of graffiti reference images and overlay
+# media, so the catalog can change without shipping a new app build.
+#
+#   GET /assets/manifest     – per catalog entry, the SHA-256 hash, size and
+#                              URL of each of its assets. Served with an
+#                              ETag, so an unchanged manifest costs a 304.
+#   GET /assets/<sha256>     – the file with that content hash. The URL can
+#                              never change meaning, so it is cached as
+#                              immutable; Range requests are supported and
+#                              the body is streamed from disk.
+#
+# Files live under the configured assets_dir. A catalog document names its
+# files in an optional `assets` field, e.g.
+#   {"id": "irlSoldier", ..., "assets": {"reference": "irlSoldier.png",
+#                                         "overlay": "overlays/soldier.mp4"}}
+# Without it, "<id>.png" in assets_dir is used as the reference image.
+# Every site has its own store; non-default sites serve the same routes
+# under /sites/<site_id>/assets/.
+#
+# Files are served from copies named by their hash in cache_dir, made
+# while hashing, never from assets_dir itself: editing a file there
+# gives it a new hash and URL, while the old URL keeps returning the
+# old bytes. Copies are shared by every site and never pruned.
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+
+from flask import abort, request, send_file
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# -------------------------------------------------------------------
+# Copies `path` into `cache_dir` as <sha256><extension>, hashing the
+# bytes as they are copied, so the copy always matches its name even if
+# the source changes meanwhile. Returns (sha256, copy path, size).
+# -------------------------------------------------------------------
+def store_copy(path, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".part")
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: src.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        copy_path = os.path.join(cache_dir, digest.hexdigest() + os.path.splitext(path)[1].lower())
+        # Replacing an existing copy swaps in identical bytes
+        os.replace(tmp_path, copy_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest.hexdigest(), copy_path, size
+
+
+# -------------------------------------------------------------------
+# Asset store
+# Maps content hashes to their copies in `cache_dir`. Copies are cached
+# per source (size, mtime) so a rescan only reads files that actually
+# changed. The manifest is rebuilt at most every `rescan_interval`
+# seconds.
+# -------------------------------------------------------------------
+class AssetStore:
+    def __init__(self, root, catalog_col, cache_dir, rescan_interval=60.0, url_prefix=""):
+        self.root = os.path.abspath(root)
+        self.catalog_col = catalog_col
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.rescan_interval = rescan_interval
+        self.url_prefix = url_prefix
+        self._lock = threading.Lock()
+        self._file_hashes = {}   # relative path -> (size, mtime_ns, sha256, copy path, copy size)
+        self._by_hash = {}       # sha256 -> copy path
+        self._manifest = None    # (built_at, body bytes, etag)
+
+    def _resolve(self, relative):
+        path = os.path.abspath(os.path.join(self.root, relative))
+        # Catalog entries may only point inside the assets directory
+        if os.path.commonpath([path, self.root]) != self.root or not os.path.isfile(path):
+            return None
+        return path
+
+    def _describe(self, relative, by_hash):
+        path = self._resolve(relative)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        cached = self._file_hashes.get(relative)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns) and os.path.isfile(cached[3]):
+            digest, copy_path, size = cached[2:]
+        else:
+            digest, copy_path, size = store_copy(path, self.cache_dir)
+            self._file_hashes[relative] = (stat.st_size, stat.st_mtime_ns, digest, copy_path, size)
+        by_hash[digest] = copy_path
+        return {
+            "hash": digest,
+            "size": size,
+            "content_type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+            "url": f"{self.url_prefix}/assets/{digest}",
+        }
+
+    def _build_manifest(self):
+        by_hash = {}
+        entries = []
+        for doc in self.catalog_col.find({}, {"_id": 0, "id": 1, "name": 1, "assets": 1}).sort("id", 1):
+            files = doc.get("assets") or {"reference": f"{doc['id']}.png"}
+            described = {}
+            for role, relative in sorted(files.items()):
+                info = self._describe(relative, by_hash) if relative else None
+                if info is not None:
+                    described[role] = info
+            entries.append({"id": doc["id"], "name": doc.get("name"), "assets": described})
+        body = json.dumps({"graffiti": entries}, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        # Swap the index in one step so concurrent downloads never see it half-built
+        self._by_hash = by_hash
+        return body, hashlib.sha256(body).hexdigest()[:32]
+
+    def manifest(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            if force or self._manifest is None or now - self._manifest[0] >= self.rescan_interval:
+                self._manifest = (now, *self._build_manifest())
+            return self._manifest[1], self._manifest[2]
+
+    def path_for(self, digest):
+        path = self._by_hash.get(digest)
+        if path is None:
+            # Unknown hash: the catalog may have changed since the last scan
+            self.manifest()
+            path = self._by_hash.get(digest)
+        return path
+
+
+# -------------------------------------------------------------------
+# Routes
+# `store_for_request` returns the AssetStore of the site being served.
+# -------------------------------------------------------------------
+def init_app(app, store_for_request):
+    mimetype = app.json.mimetype
+
+    def asset_manifest():
+        body, etag = store_for_request().manifest()
+        response = app.response_class(body, mimetype=mimetype)
+        response.set_etag(etag)
+        # Clients must revalidate, which is cheap thanks to the ETag
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
+
+    def asset_file(digest):
+        path = store_for_request().path_for(digest.lower())
+        if path is None:
+            abort(404)
+        # send_file streams through wsgi.file_wrapper (sendfile where the
+        # server supports it) and answers Range / If-None-Match requests
+        response = send_file(path, etag=digest.lower(), conditional=True,
+                             max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.immutable = True
+        response.cache_control.public = True
+        return response
+
+    for prefix in ('', '/sites/<site_id>'):
+        app.add_url_rule(prefix + '/assets/manifest', 'asset_manifest',
+                         asset_manifest, methods=['GET'])
+        app.add_url_rule(prefix + '/assets/<string(length=64):digest>', 'asset_file',
+                         asset_file, methods=['GET'])
@@ -0,0 +1,121 @@
+# bench_json.py
+
+# Micro-benchmark for the JSON serialization path of the API.
+# Compares, per request, Flask's default jsonify against the orjson-backed
+# FastJSONProvider and against pre-serialized static responses. Requests
+# go through the full WSGI stack (routing, CORS, response building) with
+# Flask's test client, without any database access.
+#
+# Usage:
+#   python bench_json.py [--requests 10000] [--rate 1000]
+import argparse
+import time
+
+from flask import Flask, jsonify
+from flask_cors import CORS
+from werkzeug.test import EnvironBuilder
+
+import fastjson
+
+WELCOME_PAYLOAD = {"message": "Welcome to GormazAR's API"}
+SCAN_PAYLOAD = {
+    "name": "Gothic inscription in north wall",
+    "scans": 18234,
+    "user_scanned": ["irlSoldier", "irlDate", "irlMonk"],
+}
+STATS_PAYLOAD = {
+    "unique_users": 124503,
+    "users_completed": 40117,
+    "sessions_count": 301887,
+    "average_session_time": 612.4412,
+}
+
+
+def build_app(fast):
+    app = Flask(__name__)
+    CORS(app)
+    if fast:
+        fastjson.init_app(app)
+    welcome = fastjson.static_response(app, WELCOME_PAYLOAD)
+
+    @app.route('/jsonify')
+    def dynamic_welcome():
+        return jsonify(WELCOME_PAYLOAD), 200
+
+    @app.route('/static')
+    def static_welcome():
+        return welcome()
+
+    @app.route('/scan')
+    def scan():
+        return jsonify(SCAN_PAYLOAD), 200
+
+    @app.route('/stats')
+    def stats():
+        return jsonify(STATS_PAYLOAD), 200
+
+    return app
+
+
+def wsgi_caller(app, path):
+    # Requests are fed straight into the WSGI callable so client-side
+    # overhead is not counted
+    environ = EnvironBuilder(path=path).get_environ()
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    def call():
+        for chunk in app.wsgi_app(dict(environ), start_response):
+            pass
+    return call
+
+
+# CPU seconds per call for `before` and `after`, best of `rounds`. The two
+# are measured alternately so drift in machine load affects both equally.
+def compare(before, after, requests, rounds=5):
+    for fn in (before, after):
+        for _ in range(min(1000, requests)):
+            fn()
+    best = [float("inf"), float("inf")]
+    for _ in range(rounds):
+        for i, fn in enumerate((before, after)):
+            start = time.process_time()
+            for _ in range(requests):
+                fn()
+            best[i] = min(best[i], time.process_time() - start)
+    return best[0] / requests, best[1] / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON serialization micro-benchmark")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--rate", type=int, default=1000,
+                        help="request rate (req/s) used to express the savings")
+    args = parser.parse_args()
+
+    default_app = build_app(fast=False)
+    fast_app = build_app(fast=True)
+    backend = "orjson" if fastjson.orjson else "stdlib json (orjson not installed)"
+    print(f"FastJSONProvider backend: {backend}")
+    print(f"{args.requests} requests per case (best of 5 rounds), savings shown at {args.rate} req/s\n")
+
+    cases = [
+        ("welcome: jsonify -> static",
+         wsgi_caller(default_app, "/jsonify"), wsgi_caller(fast_app, "/static")),
+        ("scan:    default -> fast",
+         wsgi_caller(default_app, "/scan"), wsgi_caller(fast_app, "/scan")),
+        ("stats:   default -> fast",
+         wsgi_caller(default_app, "/stats"), wsgi_caller(fast_app, "/stats")),
+        ("stats:   dumps only",
+         lambda: default_app.json.dumps(STATS_PAYLOAD), lambda: fast_app.json.dumps(STATS_PAYLOAD)),
+    ]
+    print(f"{'case':<30}{'before us':>11}{'after us':>11}{'saved us':>11}{'core % saved':>14}")
+    for label, before_fn, after_fn in cases:
+        before, after = compare(before_fn, after_fn, args.requests)
+        saved = before - after
+        print(f"{label:<30}{before * 1e6:>11.1f}{after * 1e6:>11.1f}"
+              f"{saved * 1e6:>11.1f}{saved * args.rate * 100:>13.2f}%")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+# capacity.py
+
+# Capacity-planning sweep: runs app.py under gunicorn for every
+# combination of worker processes, threads per worker and Mongo
+# maxPoolSize, drives the same synthetic visitor workload (loadgen.py)
+# at each point and reports throughput and latency per configuration.
+#
+# For each (threads, pool size) series it finds the knee: the worker
+# count after which one more step adds less than --min-gain throughput
+# (or pushes p99 over --p99-budget). Results are written as JSON so
+# runs can be compared between releases.
+#
+# Every point runs against its own scratch database, dropped afterwards,
+# with rate limiting and the access log disabled so the client host does
+# not throttle itself.
+#
+# Requires gunicorn (pip install gunicorn) and a reachable mongod.
+# Usage:
+#   python capacity.py --workers 1,2,4,8 --threads 1,4 --pool-sizes 10,100 \
+#       --mongo-uri mongodb://localhost:27017/ --json sweep.json
+import argparse
+import http.client
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from pymongo import MongoClient
+
+import loadgen
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _int_list(text):
+    return [int(value) for value in text.split(",") if value.strip()]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(port, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/readyz")
+            if conn.getresponse().status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server not ready after {timeout} s")
+
+
+# -------------------------------------------------------------------
+# One sweep point: start the server, warm it up, replay the workload
+# -------------------------------------------------------------------
+def run_point(workers, threads, pool_size, workload, warmup, args, log_dir):
+    port = _free_port()
+    database = f"{args.database_prefix}_{workers}w{threads}t{pool_size}p"
+    metrics_dir = tempfile.mkdtemp(prefix="gormazar-sweep-metrics-")
+    env = dict(os.environ,
+               MONGO_URI=args.mongo_uri,
+               MONGO_DATABASE=database,
+               MONGO_MAX_POOL_SIZE=str(pool_size),
+               SITES="{}",
+               RATE_LIMITS="{}",
+               ACCESS_LOG="",
+               SLOW_OP_MS="-1",
+               METRICS_DIR=metrics_dir)
+    command = [sys.executable, "-m", "gunicorn", "app:app",
+               "--workers", str(workers), "--threads", str(threads),
+               "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+    log_path = os.path.join(log_dir, f"{database}.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        process = subprocess.Popen(command, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            _wait_ready(port, process, args.start_timeout)
+            target = f"http://127.0.0.1:{port}"
+            if warmup:
+                loadgen.replay(warmup, target, args.speedup, args.concurrency, args.timeout)
+            report = loadgen.replay(workload, target, args.speedup, args.concurrency, args.timeout)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            MongoClient(args.mongo_uri).drop_database(database)
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    return {
+        "workers": workers,
+        "threads": threads,
+        "pool_size": pool_size,
+        "throughput_rps": report["throughput_rps"],
+        "p50_ms": report["overall"]["p50_ms"],
+        "p99_ms": report["overall"]["p99_ms"],
+        "service_p99_ms": report["service"]["p99_ms"],
+        "errors": report["errors"],
+        "requests": report["requests"],
+        "elapsed_s": report["elapsed_s"],
+        "routes": report["routes"],
+    }
+
+
+# -------------------------------------------------------------------
+# Knee per (threads, pool size) series, walking up the worker counts
+# -------------------------------------------------------------------
+def find_knees(points, min_gain, p99_budget):
+    knees = []
+    series = {}
+    for point in points:
+        series.setdefault((point["threads"], point["pool_size"]), []).append(point)
+    for (threads, pool_size), runs in sorted(series.items()):
+        runs.sort(key=lambda p: p["workers"])
+        knee = runs[-1]
+        reason = "throughput still rising at the largest worker count"
+        for current, following in zip(runs, runs[1:]):
+            gain = (following["throughput_rps"] / current["throughput_rps"] - 1
+                    if current["throughput_rps"] else 0.0)
+            if p99_budget and following["p99_ms"] > p99_budget:
+                knee, reason = current, f"p99 exceeds {p99_budget} ms with more workers"
+                break
+            if gain < min_gain:
+                knee, reason = current, f"next step adds {gain:.0%} throughput"
+                break
+        knees.append({"threads": threads, "pool_size": pool_size,
+                      "workers": knee["workers"], "throughput_rps": knee["throughput_rps"],
+                      "p99_ms": knee["p99_ms"], "reason": reason})
+    return knees
+
+
+def best_point(points, p99_budget):
+    eligible = [p for p in points if not p["errors"] and (not p99_budget or p["p99_ms"] <= p99_budget)]
+    if not eligible:
+        return None
+    # Highest throughput; ties go to the configuration using fewer resources
+    return max(eligible, key=lambda p: (p["throughput_rps"],
+                                        -(p["workers"] * p["threads"]), -p["pool_size"]))
+
+
+def print_chart(points, knees, out=sys.stdout):
+    width = 40
+    top = max((p["throughput_rps"] for p in points), default=0) or 1
+    knee_at = {(k["threads"], k["pool_size"]): k["workers"] for k in knees}
+    out.write(f"{'workers':>8}{'threads':>8}{'pool':>6}{'req/s':>10}{'p99 ms':>9}  throughput\n")
+    for point in sorted(points, key=lambda p: (p["threads"], p["pool_size"], p["workers"])):
+        bar = "#" * max(1, round(width * point["throughput_rps"] / top))
+        marker = " <- knee" if knee_at.get((point["threads"], point["pool_size"])) == point["workers"] else ""
+        errors = f" ({point['errors']} errors)" if point["errors"] else ""
+        out.write(f"{point['workers']:>8}{point['threads']:>8}{point['pool_size']:>6}"
+                  f"{point['throughput_rps']:>10}{point['p99_ms']:>9}  {bar}{marker}{errors}\n")
+
+
+# -------------------------------------------------------------------
+# Command line
+# -------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GormazAR capacity sweep")
+    parser.add_argument("--workers", type=_int_list, default=[1, 2, 4, 8])
+    parser.add_argument("--threads", type=_int_list, default=[1, 4, 8])
+    parser.add_argument("--pool-sizes", type=_int_list, default=[10, 100])
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--database-prefix", default="GormazAR_sweep")
+    parser.add_argument("--rate", type=float, default=600.0, help="visitor arrivals per minute")
+    parser.add_argument("--duration", type=float, default=600.0, help="workload length in trace seconds")
+    parser.add_argument("--warmup", type=float, default=60.0, help="warm-up length in trace seconds")
+    parser.add_argument("--speedup", type=float, default=60.0, help="time compression of the replay")
+    parser.add_argument("--concurrency", type=int, default=64, help="client connections")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--min-gain", type=float, default=0.10,
+                        help="throughput gain below which adding workers stops helping")
+    parser.add_argument("--p99-budget", type=float, default=None, help="p99 latency budget in ms")
+    parser.add_argument("--start-timeout", type=float, default=60.0)
+    parser.add_argument("--log-dir", default=None, help="keep server logs here (default: temp dir)")
+    parser.add_argument("--json", dest="json_path", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if importlib.util.find_spec("gunicorn") is None:
+        parser.error("gunicorn is not installed (pip install gunicorn)")
+
+    # Every point gets exactly the same visitors; the warm-up uses others
+    curve = loadgen.arrival_curve("constant", args.rate, args.rate, args.duration, 0.5, 0.15)
+    workload = loadgen.generate(curve, args.duration, args.seed)
+    warmup = loadgen.generate(curve, args.warmup, args.seed + 1) if args.warmup > 0 else []
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix="gormazar-sweep-logs-")
+    os.makedirs(log_dir, exist_ok=True)
+
+    grid = list(itertools.product(args.workers, args.threads, args.pool_sizes))
+    print(f"{len(grid)} points, {len(workload)} requests each "
+          f"(offered {len(workload) * args.speedup / args.duration:.0f} req/s); logs in {log_dir}",
+          file=sys.stderr)
+    points = []
+    for workers, threads, pool_size in grid:
+        print(f"  workers={workers} threads={threads} pool={pool_size} ...", end="", file=sys.stderr, flush=True)
+        point = run_point(workers, threads, pool_size, workload, warmup, args, log_dir)
+        print(f" {point['throughput_rps']} req/s, p99 {point['p99_ms']} ms", file=sys.stderr)
+        points.append(point)
+
+    knees = find_knees(points, args.min_gain, args.p99_budget)
+    best = best_point(points, args.p99_budget)
+    print_chart(points, knees)
+    for knee in knees:
+        print(f"threads={knee['threads']} pool={knee['pool_size']}: knee at {knee['workers']} "
+              f"workers, {knee['throughput_rps']} req/s ({knee['reason']})")
+    if best:
+        print(f"best: workers={best['workers']} threads={best['threads']} pool={best['pool_size']} "
+              f"at {best['throughput_rps']} req/s, p99 {best['p99_ms']} ms")
+
+    if args.json_path:
+        result = {
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "host": {"platform": platform.platform(), "python": platform.python_version(),
+                     "cpus": os.cpu_count()},
+            "workload": {"rate_per_min": args.rate, "duration_s": args.duration,
+                         "warmup_s": args.warmup, "speedup": args.speedup,
+                         "concurrency": args.concurrency, "seed": args.seed,
+                         "requests": len(workload)},
+            "points": points,
+            "knees": knees,
+            "best": best,
+        }
+        with open(args.json_path, "w", encoding="utf-8") as out:
+            json.dump(result, out, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
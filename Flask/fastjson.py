@@ -0,0 +1,77 @@
+# fastjson.py
+
+# Faster JSON handling for the API.
+#   - FastJSONProvider replaces Flask's default provider on `app.json` and
+#     serializes with orjson when it is installed. Without orjson it
+#     behaves exactly like Flask's DefaultJSONProvider.
+#   - static_response() serializes a constant payload once, so routes that
+#     always return the same body skip JSON encoding on every request.
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # Datetimes and dataclasses go through DefaultJSONProvider.default so
+    # the output matches Flask's (e.g. HTTP dates instead of ISO strings)
+    _base_options = (
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        | orjson.OPT_NON_STR_KEYS
+    ) if orjson else 0
+
+    def _orjson_options(self, indent=False):
+        options = self._base_options
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj, indent=False):
+        if orjson is None:
+            return self.dumps(obj, indent=2 if indent else None).encode("utf-8")
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options(indent))
+
+    def dumps(self, obj, **kwargs):
+        # orjson has no equivalent for most json.dumps keyword arguments,
+        # so calls that pass any fall back to the standard library
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Same contract as DefaultJSONProvider.response, but the body is
+        # produced as bytes directly instead of str -> bytes
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            self.dumps_bytes(obj, indent=indent), mimetype=self.mimetype
+        )
+
+
+# -------------------------------------------------------------------
+# Pre-serialized constant responses
+# Returns a callable producing a fresh (response, status) tuple whose body
+# was encoded once up front. A new Response object is still created per
+# request because after_request hooks (CORS) modify its headers.
+# -------------------------------------------------------------------
+def static_response(app, payload, status=200):
+    body = app.json.dumps(payload).encode("utf-8")
+    mimetype = app.json.mimetype
+
+    def make():
+        return app.response_class(body, mimetype=mimetype), status
+    return make
+
+
+def init_app(app):
+    app.json_provider_class = FastJSONProvider
+    app.json = FastJSONProvider(app)
@@ -0,0 +1,170 @@
+# health.py
+
+# Liveness and readiness probes for load balancers and orchestrators.
+#   GET /healthz  – the process is up and serving requests. Never touches
+#                   Mongo; always 200.
+#   GET /readyz   – Mongo is reachable. 200 when ready, 503 otherwise,
+#                   with connection-pool usage, wait-queue length and the
+#                   time since the last successful Mongo operation.
+#
+# Probes arrive constantly, so /readyz never costs the database a command
+# per call: any successful application command within health_ping_seconds
+# already proves Mongo is reachable, and otherwise a single `ping` is sent
+# at most once per health_ping_seconds. Concurrent probes never wait on
+# a ping in flight; they answer from the last result.
+import threading
+import time
+
+import pymongo
+from flask import jsonify
+from pymongo import monitoring
+
+import fastjson
+
+
+class HealthMonitor(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    def __init__(self, ping_interval=5.0, ping_timeout_ms=2000, max_pool_size=None):
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout_ms / 1000.0
+        self.max_pool_size = max_pool_size
+        self.client = None
+
+        self.last_success = None    # monotonic time of the last successful command
+        self._ping = None           # (checked_at, ok, error)
+        self._ping_lock = threading.Lock()
+
+        self._pool_lock = threading.Lock()
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+
+    # ---------------------------------------------------------------
+    # CommandListener callbacks
+    # ---------------------------------------------------------------
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.last_success = time.monotonic()
+
+    def failed(self, event):
+        pass
+
+    # ---------------------------------------------------------------
+    # ConnectionPoolListener callbacks, summed over every server's pool
+    # ---------------------------------------------------------------
+    def _add(self, **deltas):
+        with self._pool_lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def connection_created(self, event):
+        self._add(open=1)
+
+    def connection_closed(self, event):
+        self._add(open=-1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, in_use=1)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    # ---------------------------------------------------------------
+    # Readiness
+    # ---------------------------------------------------------------
+    def _ping_if_due(self, now):
+        if self._ping is not None and now - self._ping[0] < self.ping_interval:
+            return
+        if not self._ping_lock.acquire(blocking=False):
+            return  # another probe is already pinging
+        try:
+            try:
+                with pymongo.timeout(self.ping_timeout):
+                    self.client.admin.command("ping")
+                self._ping = (time.monotonic(), True, None)
+            except Exception as exc:
+                self._ping = (time.monotonic(), False, str(exc))
+        finally:
+            self._ping_lock.release()
+
+    def readiness(self):
+        now = time.monotonic()
+        last_success = self.last_success
+        recent = last_success is not None and now - last_success < self.ping_interval
+        if not recent:
+            self._ping_if_due(now)
+
+        now = time.monotonic()
+        ping = self._ping
+        if recent:
+            ok, error = True, None
+        elif ping is not None:
+            ok, error = ping[1], ping[2]
+        else:
+            ok, error = False, "not checked yet"
+
+        last_success = self.last_success or last_success
+        return ok, {
+            "status": "ready" if ok else "unavailable",
+            "mongo": {
+                "ok": ok,
+                "error": error,
+                "last_success_seconds_ago":
+                    round(now - last_success, 3) if last_success is not None else None,
+                "last_ping_seconds_ago": round(now - ping[0], 3) if ping is not None else None,
+            },
+            "pool": {
+                "max_size": self.max_pool_size,
+                "open": self.open,
+                "in_use": self.in_use,
+                "wait_queue": self.waiting,
+            },
+        }
+
+
+def init_app(app, monitor):
+    ALIVE = fastjson.static_response(app, {"status": "ok"}, 200)
+
+    # ---------------------------------------------------------------
+    # Route: Liveness
+    # GET /healthz
+    # ---------------------------------------------------------------
+    def healthz():
+        return ALIVE()
+
+    # ---------------------------------------------------------------
+    # Route: Readiness
+    # GET /readyz
+    # 200 when Mongo is reachable, 503 otherwise
+    # ---------------------------------------------------------------
+    def readyz():
+        ok, body = monitor.readiness()
+        response = jsonify(body)
+        response.status_code = 200 if ok else 503
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    app.add_url_rule('/healthz', 'healthz', healthz, methods=['GET'])
+    app.add_url_rule('/readyz', 'readyz', readyz, methods=['GET'])
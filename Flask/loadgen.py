@@ -0,0 +1,382 @@
+# loadgen.py
+
+# Synthetic visitor traffic for sizing the API, plus a request recorder
+# and a trace replayer.
+#
+# A trace is an NDJSON file with one request per line:
+#   {"t": 12.5, "visitor": "…", "method": "POST",
+#    "path": "/increment/irlDate", "form": {"user_id": "…"}}
+# where `t` is the offset in seconds from the start of the trace.
+#
+# Generated visitors follow the Unity client: UserRegister posts
+# /registerUser/<id> at start-up, SimpleImageIncrementer posts
+# /increment/<ref> once per graffiti found (up to three), and
+# OnApplicationPause posts /endSession/<id> with the session length.
+#
+# Usage:
+#   python loadgen.py generate -o trace.ndjson --curve festival --rate 30 --duration 3600
+#   python loadgen.py replay trace.ndjson --target http://localhost:5000 --speedup 20
+# Recording real traffic: set record_trace_path (env RECORD_TRACE_PATH)
+# and the app appends every request it serves to that file.
+import argparse
+import http.client
+import json
+import math
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+GRAFFITI_IDS = ("irlSoldier", "irlDate", "irlMonk")
+
+# Routes may be prefixed with /sites/<site_id> on multi-site servers
+SITE_PREFIX = r"^(?:/sites/[^/]+)?"
+ROUTE_PATTERNS = [
+    ("home",         re.compile(SITE_PREFIX + r"/?$")),
+    ("registerUser", re.compile(SITE_PREFIX + r"/registerUser/(?P<user>[^/]+)$")),
+    ("bootstrap",    re.compile(SITE_PREFIX + r"/bootstrap/(?P<user>[^/]+)$")),
+    ("increment",    re.compile(SITE_PREFIX + r"/increment/[^/]+$")),
+    ("endSession",   re.compile(SITE_PREFIX + r"/endSession/(?P<user>[^/]+)$")),
+]
+
+
+def route_name(path):
+    for name, pattern in ROUTE_PATTERNS:
+        if pattern.match(path):
+            return name
+    return "other"
+
+
+def visitor_of(path, form):
+    # The device id is either part of the path or sent as user_id
+    for _, pattern in ROUTE_PATTERNS:
+        match = pattern.match(path)
+        if match and "user" in match.groupdict():
+            return match.group("user")
+    return form.get("user_id") or ""
+
+
+# -------------------------------------------------------------------
+# Arrival curves
+# Each returns the visitor arrival rate (visitors per second) at time t
+# seconds into a trace of the given duration. Rates are given on the
+# command line in visitors per minute.
+#   constant  – flat `rate`
+#   ramp      – grows linearly from `base_rate` to `rate`
+#   festival  – `base_rate` plus a Gaussian peak of height `rate`
+#               centred at `peak_at` (fraction of duration) with
+#               standard deviation `peak_width` (fraction of duration)
+# -------------------------------------------------------------------
+def arrival_curve(kind, rate, base_rate, duration, peak_at, peak_width):
+    rate, base_rate = rate / 60.0, base_rate / 60.0
+    if kind == "constant":
+        return lambda t: rate
+    if kind == "ramp":
+        return lambda t: base_rate + (rate - base_rate) * t / duration
+    if kind == "festival":
+        centre, width = peak_at * duration, max(peak_width * duration, 1e-9)
+        return lambda t: base_rate + rate * math.exp(-0.5 * ((t - centre) / width) ** 2)
+    raise ValueError(f"Unknown arrival curve: {kind}")
+
+
+# Non-homogeneous Poisson arrivals by thinning a homogeneous process
+# running at the curve's maximum rate
+def arrivals(curve, duration, rng, resolution=1000):
+    max_rate = max(curve(duration * i / resolution) for i in range(resolution + 1))
+    if max_rate <= 0:
+        return
+    t = 0.0
+    while True:
+        t += rng.expovariate(max_rate)
+        if t >= duration:
+            return
+        if rng.random() * max_rate <= curve(t):
+            yield t
+
+
+# -------------------------------------------------------------------
+# Visitor model
+# A visitor registers on arrival, walks to k graffiti (k drawn from
+# scan_weights for k = 0..3) with exponential gaps of mean `dwell`
+# seconds, and ends the session after a further exponential tail.
+# -------------------------------------------------------------------
+def visitor_events(arrival, rng, scan_weights, dwell, tail, graffiti=GRAFFITI_IDS):
+    user_id = uuid.UUID(int=rng.getrandbits(128)).hex
+    events = [{"t": arrival, "visitor": user_id, "method": "POST",
+               "path": f"/registerUser/{user_id}", "form": {}}]
+
+    scans = rng.choices(range(len(scan_weights)), weights=scan_weights)[0]
+    t = arrival
+    for doc_id in rng.sample(graffiti, min(scans, len(graffiti))):
+        t += rng.expovariate(1.0 / dwell)
+        events.append({"t": t, "visitor": user_id, "method": "POST",
+                       "path": f"/increment/{doc_id}", "form": {"user_id": user_id}})
+
+    t += rng.expovariate(1.0 / tail)
+    events.append({"t": t, "visitor": user_id, "method": "POST",
+                   "path": f"/endSession/{user_id}",
+                   "form": {"user_id": user_id, "duration": f"{t - arrival:.1f}"}})
+    return events
+
+
+def generate(curve, duration, seed=None, scan_weights=(0.1, 0.2, 0.3, 0.4),
+             dwell=180.0, tail=120.0):
+    rng = random.Random(seed)
+    events = []
+    for arrival in arrivals(curve, duration, rng):
+        events.extend(visitor_events(arrival, rng, scan_weights, dwell, tail))
+    events.sort(key=lambda e: e["t"])
+    return events
+
+
+def write_trace(events, out):
+    for event in events:
+        out.write(json.dumps(event, separators=(",", ":")))
+        out.write("\n")
+
+
+def read_trace(path):
+    with open(path, encoding="utf-8") as fh:
+        events = [json.loads(line) for line in fh if line.strip()]
+    events.sort(key=lambda e: e["t"])
+    # Recorded traces carry wall-clock times: rebase them to offsets
+    start = events[0]["t"] if events else 0.0
+    for event in events:
+        event["t"] -= start
+        event.setdefault("form", {})
+        event.setdefault("visitor", visitor_of(event["path"], event["form"]))
+    return events
+
+
+# -------------------------------------------------------------------
+# Recorder
+# Appends every request served by the app to an NDJSON trace. Meant to
+# be switched on for a while on a live server, then replayed elsewhere.
+# -------------------------------------------------------------------
+class Recorder:
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def record(self, request):
+        form = request.form.to_dict()
+        line = json.dumps({
+            "t": time.time(),
+            "visitor": visitor_of(request.path, form),
+            "method": request.method,
+            "path": request.path,
+            "form": form,
+        }, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+
+
+def init_recorder(app, path):
+    if not path:
+        return None
+    from flask import request
+
+    recorder = Recorder(path)
+
+    @app.before_request
+    def record_request():
+        recorder.record(request)
+
+    return recorder
+
+
+# -------------------------------------------------------------------
+# Replayer
+# The calling thread releases events at t / speedup. Events of one
+# visitor always go to the same worker, so a visitor's requests keep
+# their order; each worker holds a persistent HTTP connection.
+#
+# Latency is measured from when a request was released to its worker,
+# not from when the worker got round to sending it: once the server
+# falls behind, requests wait in the worker queues, and leaving that wait
+# out would hide saturation (coordinated omission). The time from send
+# to response alone is reported separately as "service".
+# -------------------------------------------------------------------
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(math.ceil(fraction * len(sorted_values))) - 1)
+    return sorted_values[max(index, 0)]
+
+
+def summarize(samples, errors, elapsed, lag, service=()):
+    report = {"requests": 0, "errors": 0, "elapsed_s": round(elapsed, 3),
+              "max_dispatch_lag_ms": round(lag * 1000, 2), "routes": {}}
+    everything = []
+    for route in sorted(set(samples) | set(errors)):
+        latencies = sorted(samples.get(route, []))
+        everything.extend(latencies)
+        report["routes"][route] = _latency_summary(latencies, errors.get(route, 0))
+    report["requests"] = len(everything) + sum(errors.values())
+    report["errors"] = sum(errors.values())
+    report["throughput_rps"] = round(report["requests"] / elapsed, 2) if elapsed else 0.0
+    report["overall"] = _latency_summary(sorted(everything), report["errors"])
+    report["service"] = _latency_summary(sorted(service), 0)
+    return report
+
+
+def _latency_summary(latencies, errors):
+    return {
+        "count": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round((latencies[-1] if latencies else 0.0) * 1000, 2),
+    }
+
+
+class _Worker(threading.Thread):
+    def __init__(self, target, timeout, results):
+        super().__init__(daemon=True)
+        parts = urlsplit(target)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.results = results
+        self.queue = queue.Queue()
+        self.conn = None
+
+    def _send(self, event):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        body = urlencode(event["form"]) if event["form"] else ""
+        headers = {"Content-Type": "application/x-www-form-urlencoded"} if body else {}
+        self.conn.request(event["method"], self.prefix + event["path"], body=body, headers=headers)
+        response = self.conn.getresponse()
+        response.read()
+        return response.status
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            released, event = item
+            route = route_name(event["path"])
+            start = time.perf_counter()
+            try:
+                status = self._send(event)
+                ok = status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                if self.conn is not None:
+                    self.conn.close()
+                self.conn = None
+            end = time.perf_counter()
+            self.results(route, end - released, end - start, ok)
+
+
+def replay(events, target, speedup=1.0, concurrency=32, timeout=10.0):
+    samples, errors, service = {}, {}, []
+    lock = threading.Lock()
+
+    def results(route, latency, service_time, ok):
+        with lock:
+            if ok:
+                samples.setdefault(route, []).append(latency)
+                service.append(service_time)
+            else:
+                errors[route] = errors.get(route, 0) + 1
+
+    workers = [_Worker(target, timeout, results) for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+
+    max_lag = 0.0
+    start = time.perf_counter()
+    for event in events:
+        due = start + event["t"] / speedup
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            max_lag = max(max_lag, -delay)
+        released = max(due, time.perf_counter())
+        workers[hash(event["visitor"]) % concurrency].queue.put((released, event))
+
+    for worker in workers:
+        worker.queue.put(None)
+    for worker in workers:
+        worker.join()
+    return summarize(samples, errors, time.perf_counter() - start, max_lag, service)
+
+
+def print_report(report, out=sys.stdout):
+    out.write(f"{report['requests']} requests, {report['errors']} errors, "
+              f"{report['throughput_rps']} req/s over {report['elapsed_s']} s "
+              f"(max dispatch lag {report['max_dispatch_lag_ms']} ms)\n")
+    out.write(f"{'route':<14}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p90 ms':>10}"
+              f"{'p99 ms':>10}{'max ms':>10}\n")
+    rows = list(report["routes"].items()) + [("overall", report["overall"]),
+                                             ("service", report["service"])]
+    for route, s in rows:
+        out.write(f"{route:<14}{s['count']:>8}{s['errors']:>8}{s['p50_ms']:>10}"
+                  f"{s['p90_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}\n")
+
+
+# -------------------------------------------------------------------
+# Command line
+# -------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GormazAR synthetic traffic tool")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="write a synthetic visitor trace")
+    gen.add_argument("-o", "--output", default="-")
+    gen.add_argument("--curve", choices=("constant", "ramp", "festival"), default="festival")
+    gen.add_argument("--duration", type=float, default=3600.0, help="trace length in seconds")
+    gen.add_argument("--rate", type=float, default=30.0, help="peak arrivals per minute")
+    gen.add_argument("--base-rate", type=float, default=2.0, help="off-peak arrivals per minute")
+    gen.add_argument("--peak-at", type=float, default=0.5, help="peak position (fraction of duration)")
+    gen.add_argument("--peak-width", type=float, default=0.15, help="peak std dev (fraction of duration)")
+    gen.add_argument("--scan-weights", default="0.1,0.2,0.3,0.4",
+                     help="relative weights of visitors scanning 0,1,2,3 graffiti")
+    gen.add_argument("--dwell", type=float, default=180.0, help="mean seconds between scans")
+    gen.add_argument("--tail", type=float, default=120.0, help="mean seconds from last scan to session end")
+    gen.add_argument("--seed", type=int)
+
+    rep = sub.add_parser("replay", help="replay a generated or recorded trace")
+    rep.add_argument("trace")
+    rep.add_argument("--target", default="http://localhost:5000")
+    rep.add_argument("--speedup", type=float, default=1.0, help="time compression factor")
+    rep.add_argument("--concurrency", type=int, default=32)
+    rep.add_argument("--timeout", type=float, default=10.0)
+    rep.add_argument("--json", dest="json_path", help="also write the report as JSON to this file")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        curve = arrival_curve(args.curve, args.rate, args.base_rate, args.duration,
+                              args.peak_at, args.peak_width)
+        weights = [float(w) for w in args.scan_weights.split(",")]
+        events = generate(curve, args.duration, args.seed, weights, args.dwell, args.tail)
+        if args.output == "-":
+            write_trace(events, sys.stdout)
+        else:
+            with open(args.output, "w", encoding="utf-8") as out:
+                write_trace(events, out)
+        visitors = len({e["visitor"] for e in events})
+        print(f"{visitors} visitors, {len(events)} requests", file=sys.stderr)
+        return 0
+
+    report = replay(read_trace(args.trace), args.target, args.speedup,
+                    args.concurrency, args.timeout)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as out:
+            json.dump(report, out, indent=2)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,389 @@
+# metrics.py
+
+# Request metrics that stay correct under several pre-fork workers.
+# Every worker process keeps its counters and histogram buckets in its
+# own memory-mapped file under metrics_dir; a scrape of
+#   GET /metrics   (admin token required, Prometheus text format)
+# on any worker reads every file and sums them, so the numbers cover the
+# whole server, not whichever worker answered.
+#
+# File layout: a fixed prefix (magic, header length, slot and row
+# counts), a JSON header naming each slot, then `rows` rows of one
+# float64 per slot. Each request thread leases its own row, so an update
+# is a plain `+=` on memory no other thread writes: no lock on the hot
+# path. A value is the sum of its slot over every row of every file.
+# Rows of finished threads are reused by new ones; threads beyond `rows`
+# share one overflow row behind a lock.
+#
+# Files outlive their worker, so nothing is lost when a worker restarts.
+# On POSIX, scrapes fold the files of dead workers into compacted.json
+# (under an flock) and delete them, so the directory does not grow with
+# every restart. Delete the directory to reset all counters.
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from flask import request
+
+from admin import admin_required
+
+try:
+    import fcntl
+except ImportError:  # Windows: no compaction
+    fcntl = None
+
+MAGIC = b"GZMETR01"
+PREFIX = struct.Struct("<8sIII")   # magic, header length, slots, rows
+PAGE = 4096
+DEFAULT_ROWS = 64
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FILE_SUFFIX = ".metrics"
+COMPACTED = "compacted.json"
+
+
+def _data_offset(header_length):
+    return -(-(PREFIX.size + header_length) // PAGE) * PAGE
+
+
+def _labels_key(labels):
+    return json.dumps(labels, sort_keys=True)
+
+
+class _RowLease:
+    # Returns the row to the free list when its thread ends
+    def __init__(self, store, base):
+        self.store = store
+        self.base = base
+
+    def __del__(self):
+        self.store._free.append(self.base)
+
+
+class MetricsStore:
+    def __init__(self, directory, rows=DEFAULT_ROWS):
+        self.directory = directory
+        self.rows = rows
+        self._metrics = {}      # name -> {"type", "help"}
+        self._slots = []        # [name, labels, suffix] per slot
+        self._index = {}        # (name, labels key, suffix) -> slot
+        self._lock = threading.Lock()
+        self._overflow_lock = threading.Lock()
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Nothing is shared with a parent process: a forked worker maps its
+        # own file on first use
+        self._values = None
+        self._path = None
+        self._local = threading.local()
+        self._free = []
+        self._next_row = 0
+
+    # ---------------------------------------------------------------
+    # Schema, declared before the first update
+    # ---------------------------------------------------------------
+    def _slot(self, name, labels, suffix=""):
+        if self._values is not None:
+            raise RuntimeError("Metrics must be declared before the first update")
+        key = (name, _labels_key(labels), suffix)
+        if key not in self._index:
+            self._index[key] = len(self._slots)
+            self._slots.append([name, dict(labels), suffix])
+        return self._index[key]
+
+    # Returns {labels key: slot}
+    def counter(self, name, help_text, label_sets=({},)):
+        self._metrics[name] = {"type": "counter", "help": help_text}
+        return {_labels_key(labels): self._slot(name, labels) for labels in label_sets}
+
+    # Returns {labels key: (first bucket slot, sum slot, count slot)};
+    # bucket slots are contiguous and the last one is +Inf
+    def histogram(self, name, help_text, label_sets=({},), buckets=DEFAULT_BUCKETS):
+        self._metrics[name] = {"type": "histogram", "help": help_text}
+        slots = {}
+        for labels in label_sets:
+            first = None
+            for bound in [*buckets, "+Inf"]:
+                slot = self._slot(name, {**labels, "le": str(bound)}, "_bucket")
+                first = slot if first is None else first
+            slots[_labels_key(labels)] = (first, self._slot(name, labels, "_sum"),
+                                          self._slot(name, labels, "_count"))
+        return slots
+
+    # ---------------------------------------------------------------
+    # Hot path
+    # ---------------------------------------------------------------
+    def _attach(self):
+        with self._lock:
+            if self._values is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            header = json.dumps({"metrics": self._metrics, "slots": self._slots}).encode("utf-8")
+            offset = _data_offset(len(header))
+            size = offset + self.rows * len(self._slots) * 8
+            path = os.path.join(self.directory, f"worker-{os.getpid()}-{time.time_ns()}{FILE_SUFFIX}")
+            with open(path, "w+b") as fh:
+                fh.truncate(size)
+                fh.write(PREFIX.pack(MAGIC, len(header), len(self._slots), self.rows))
+                fh.write(header)
+                fh.flush()
+                mapped = mmap.mmap(fh.fileno(), size)
+            self._path = path
+            self._values = memoryview(mapped)[offset:].cast("d")
+
+    def _lease(self):
+        if self._values is None:
+            self._attach()
+        try:
+            base = self._free.pop()
+        except IndexError:
+            with self._lock:
+                row, self._next_row = self._next_row, self._next_row + 1
+            if row >= self.rows - 1:
+                return None  # overflow row
+            base = row * len(self._slots)
+        lease = self._local.lease = _RowLease(self, base)
+        return lease
+
+    def add(self, slot, amount=1.0):
+        lease = getattr(self._local, "lease", None) or self._lease()
+        if lease is not None:
+            self._values[lease.base + slot] += amount
+        else:
+            overflow = (self.rows - 1) * len(self._slots)
+            with self._overflow_lock:
+                self._values[overflow + slot] += amount
+
+    def observe(self, histogram_slots, value, buckets=DEFAULT_BUCKETS):
+        first, sum_slot, count_slot = histogram_slots
+        index = len(buckets)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                index = i
+                break
+        self.add(first + index)
+        self.add(sum_slot, value)
+        self.add(count_slot)
+
+    # ---------------------------------------------------------------
+    # Scrape: sum every worker file (and the compacted dead workers)
+    # ---------------------------------------------------------------
+    def collect(self):
+        if fcntl is None:
+            return self._read_all()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".compact.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._compact()
+            # Held while reading: a compaction between reading compacted.json
+            # and the worker files would drop a dead worker's totals from
+            # this scrape. Scrapes may still read side by side.
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            return self._read_all()
+
+    def _read_all(self):
+        metrics, totals = {}, {}
+        compacted = _load_compacted(self.directory)
+        metrics.update(compacted["metrics"])
+        for name, labels, suffix, value in compacted["values"]:
+            key = (name, _labels_key(labels), suffix)
+            totals[key] = totals.get(key, 0.0) + value
+        for path in _worker_files(self.directory):
+            if os.path.basename(path) in compacted["merged"]:
+                continue
+            parsed = _read_file(path)
+            if parsed is None:
+                continue
+            metrics.update(parsed[0])
+            for key, value in parsed[1].items():
+                totals[key] = totals.get(key, 0.0) + value
+        return metrics, totals
+
+    # Caller holds the exclusive compaction lock
+    def _compact(self):
+        compacted = _load_compacted(self.directory)
+        existing = {os.path.basename(p): p for p in _worker_files(self.directory)}
+        # Forget merged files that are gone; delete leftovers of a crash
+        compacted["merged"] = [name for name in compacted["merged"] if name in existing]
+        for name in compacted["merged"]:
+            os.unlink(existing.pop(name))
+        compacted["merged"] = []
+
+        dead = [path for name, path in existing.items()
+                if path != self._path and not _alive(_file_pid(name))]
+        if not dead:
+            return
+        values = {(n, _labels_key(l), s): v for n, l, s, v in compacted["values"]}
+        for path in dead:
+            parsed = _read_file(path)
+            if parsed is not None:
+                compacted["metrics"].update(parsed[0])
+                for key, value in parsed[1].items():
+                    values[key] = values.get(key, 0.0) + value
+            compacted["merged"].append(os.path.basename(path))
+        compacted["values"] = [[n, json.loads(l), s, v] for (n, l, s), v in values.items()]
+        tmp_path = os.path.join(self.directory, COMPACTED + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(compacted, fh)
+        os.replace(tmp_path, os.path.join(self.directory, COMPACTED))
+        for path in dead:
+            os.unlink(path)
+
+
+def _worker_files(directory):
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.endswith(FILE_SUFFIX)]
+
+
+def _file_pid(name):
+    return int(name.split("-")[1])
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load_compacted(directory):
+    path = os.path.join(directory, COMPACTED)
+    if not os.path.exists(path):
+        return {"metrics": {}, "values": [], "merged": []}
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _read_file(path):
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+    except FileNotFoundError:
+        return None  # compacted by another worker meanwhile
+    if len(data) < PREFIX.size:
+        return None
+    magic, header_length, n_slots, n_rows = PREFIX.unpack_from(data)
+    offset = _data_offset(header_length)
+    if magic != MAGIC or len(data) < offset + n_slots * n_rows * 8:
+        return None
+    header = json.loads(data[PREFIX.size:PREFIX.size + header_length])
+    values = memoryview(data)[offset:offset + n_slots * n_rows * 8].cast("d")
+    totals = {}
+    for slot, (name, labels, suffix) in enumerate(header["slots"]):
+        totals[(name, _labels_key(labels), suffix)] = sum(values[slot::n_slots])
+    return header["metrics"], totals
+
+
+# -------------------------------------------------------------------
+# Prometheus text exposition
+# -------------------------------------------------------------------
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def render(metrics, totals):
+    by_name = {}
+    for (name, labels, suffix), value in totals.items():
+        by_name.setdefault(name, []).append((suffix, json.loads(labels), value))
+
+    lines = []
+    for name in sorted(by_name):
+        info = metrics.get(name, {"type": "untyped", "help": ""})
+        lines.append(f"# HELP {name} {info['help']}")
+        lines.append(f"# TYPE {name} {info['type']}")
+        series = by_name[name]
+        if info["type"] == "histogram":
+            # Buckets are stored per interval; the exposition is cumulative
+            def order(item):
+                suffix, labels, _ = item
+                group = _labels_key({k: v for k, v in labels.items() if k != "le"})
+                le = labels.get("le", "+Inf")
+                return group, suffix != "_bucket", suffix, float("inf") if le == "+Inf" else float(le)
+
+            cumulative = {}
+            for suffix, labels, value in sorted(series, key=order):
+                if suffix == "_bucket":
+                    group = order((suffix, labels, value))[0]
+                    value = cumulative[group] = cumulative.get(group, 0.0) + value
+                text = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+                lines.append(f"{name}{suffix}{{{text}}} {_format_value(value)}")
+        else:
+            for suffix, labels, value in sorted(series, key=lambda item: _labels_key(item[1])):
+                text = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+                lines.append(f"{name}{suffix}{{{text}}} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------------------------------------------------
+# Request instrumentation
+# Call after every route is registered: one series per endpoint.
+# -------------------------------------------------------------------
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+
+
+def init_app(app, store):
+    endpoints = sorted(app.view_functions) + ["metrics", "unmatched"]
+    requests_total = store.counter(
+        "gormazar_http_requests_total", "HTTP requests by endpoint and status class.",
+        [{"endpoint": e, "status": s} for e in endpoints for s in STATUS_CLASSES])
+    duration = store.histogram(
+        "gormazar_http_request_duration_seconds", "HTTP request latency by endpoint.",
+        [{"endpoint": e} for e in endpoints])
+
+    # Slots per endpoint, resolved once: (status class -> slot, histogram)
+    slots = {e: ({s: requests_total[_labels_key({"endpoint": e, "status": s})]
+                  for s in STATUS_CLASSES},
+                 duration[_labels_key({"endpoint": e})])
+             for e in endpoints}
+
+    # Timed from the WSGI entry point rather than a before_request hook:
+    # requests rejected by an earlier hook or the site lookup (429, 404)
+    # never reach later hooks, but must still be counted
+    wsgi_app = app.wsgi_app
+
+    def timed_wsgi_app(environ, start_response):
+        environ["gormazar.metrics_start"] = time.perf_counter()
+        return wsgi_app(environ, start_response)
+
+    app.wsgi_app = timed_wsgi_app
+
+    @app.after_request
+    def status_metrics(response):
+        request.environ["gormazar.metrics_status"] = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_metrics(exc):
+        start = request.environ.get("gormazar.metrics_start")
+        if start is None:
+            return
+        status = request.environ.get("gormazar.metrics_status", 500)
+        by_status, histogram = slots.get(request.endpoint) or slots["unmatched"]
+        store.add(by_status[STATUS_CLASSES[min(max(status // 100, 1), 5) - 1]])
+        store.observe(histogram, time.perf_counter() - start)
+
+    # -----------------------------------------------------------------
+    # Route: Metrics
+    # GET /metrics
+    # All workers' counters and histograms, Prometheus text format
+    # -----------------------------------------------------------------
+    @admin_required
+    def metrics():
+        body = render(*store.collect())
+        return app.response_class(body, mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
@@ -0,0 +1,219 @@
+# profiler.py
+
+# Opt-in sampling profiler for a live worker. Stacks of the Python threads
+# are sampled from a background thread with sys._current_frames() and
+# written as collapsed stacks ("frame;frame;frame count" per line), the
+# input format of flamegraph.pl, speedscope and similar tools.
+#
+# Two ways to use it:
+#   - Whole process for N seconds: POST /admin/profile?seconds=N[&hz=H]
+#     (admin token required), or send SIGUSR2 to the worker for a
+#     profile of profile_signal_seconds. Writes
+#     <profile_dir>/process-<pid>-<timestamp>.collapsed
+#   - A fraction of requests per route: profile_request_rates maps an
+#     endpoint name (or "*") to the fraction of its requests to sample.
+#     Stacks of the selected request threads are accumulated per route
+#     and flushed to <profile_dir>/route-<endpoint>-<pid>.collapsed.
+#
+# When neither is in use nothing is hooked into the request path and no
+# sampler thread runs.
+import atexit
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import jsonify, request
+
+from admin import admin_required
+
+DEFAULT_HZ = 100
+MAX_SECONDS = 600
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+def write_collapsed(path, stacks, mode="w"):
+    tmp_path = path + ".tmp"
+    if mode == "a" and os.path.exists(path):
+        # Merge with what earlier flushes already wrote
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                if stack:
+                    stacks[stack] += int(count)
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        for stack, count in stacks.most_common():
+            fh.write(f"{stack} {count}\n")
+    os.replace(tmp_path, path)
+
+
+# -------------------------------------------------------------------
+# Whole-process profile
+# One sampler thread for a fixed duration; only one may run at a time.
+# -------------------------------------------------------------------
+class ProcessProfile(threading.Thread):
+    def __init__(self, path, seconds, hz):
+        super().__init__(name="sampling-profiler", daemon=True)
+        self.path = path
+        self.seconds = seconds
+        self.interval = 1.0 / hz
+        self.samples = 0
+
+    def run(self):
+        me = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    stacks[collapse(frame)] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        write_collapsed(self.path, stacks)
+
+
+# -------------------------------------------------------------------
+# Per-request profiling
+# Selected request threads are registered in `_watched`; a single sampler
+# thread samples only those and sleeps while none are registered.
+# -------------------------------------------------------------------
+class RequestSampler:
+    def __init__(self, directory, rates, hz, flush_interval=30.0):
+        self.directory = directory
+        self.rates = rates
+        self.interval = 1.0 / hz
+        self.flush_interval = flush_interval
+        self._watched = {}          # thread ident -> endpoint
+        self._stacks = {}           # endpoint -> Counter
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def rate_for(self, endpoint):
+        return self.rates.get(endpoint, self.rates.get("*", 0.0))
+
+    def begin(self, endpoint):
+        rate = self.rate_for(endpoint)
+        if rate <= 0 or random.random() >= rate:
+            return False
+        with self._lock:
+            self._watched[threading.get_ident()] = endpoint
+        self._wakeup.set()
+        return True
+
+    def end(self):
+        with self._lock:
+            self._watched.pop(threading.get_ident(), None)
+
+    def flush(self):
+        with self._lock:
+            pending, self._stacks = self._stacks, {}
+        for endpoint, stacks in pending.items():
+            path = os.path.join(self.directory, f"route-{endpoint}-{os.getpid()}.collapsed")
+            write_collapsed(path, stacks, mode="a")
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            if not self._watched:
+                self._wakeup.clear()
+                self._wakeup.wait(self.flush_interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, endpoint in self._watched.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self._stacks.setdefault(endpoint, Counter())[collapse(frame)] += 1
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+            time.sleep(self.interval)
+
+
+class Profiler:
+    def __init__(self, directory, hz=DEFAULT_HZ):
+        self.directory = directory
+        self.hz = hz
+        self._lock = threading.Lock()
+        self._current = None
+
+    def start(self, seconds, hz=None):
+        with self._lock:
+            if self._current is not None and self._current.is_alive():
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"process-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+            self._current = ProcessProfile(os.path.join(self.directory, name), seconds, hz or self.hz)
+            self._current.start()
+            return self._current.path
+
+
+def init_app(app, directory, hz=DEFAULT_HZ, request_rates=None, signal_seconds=30.0):
+    profiler = Profiler(directory, hz)
+
+    # ---------------------------------------------------------------
+    # Route: Start Profile
+    # POST /admin/profile?seconds=N&hz=H
+    # Starts a whole-process profile in the background and returns the
+    # path it will be written to; 409 if one is already running.
+    # ---------------------------------------------------------------
+    @admin_required
+    def start_profile():
+        try:
+            seconds = float(request.args.get("seconds", 10))
+            hz = int(request.args.get("hz", profiler.hz))
+        except ValueError:
+            return jsonify({"error": "Invalid 'seconds' or 'hz' value."}), 400
+        if not 0 < seconds <= MAX_SECONDS or not 0 < hz <= 1000:
+            return jsonify({"error": f"'seconds' must be in (0, {MAX_SECONDS}] and 'hz' in (0, 1000]."}), 400
+        path = profiler.start(seconds, hz)
+        if path is None:
+            return jsonify({"error": "A profile is already running."}), 409
+        return jsonify({"profile": path, "seconds": seconds, "hz": hz}), 202
+
+    app.add_url_rule('/admin/profile', 'start_profile', start_profile, methods=['POST'])
+
+    # SIGUSR2 starts a profile without going through HTTP. The handler only
+    # spawns a thread: it may interrupt a request holding the profiler lock.
+    def on_signal(signum, frame):
+        threading.Thread(target=profiler.start, args=(signal_seconds,), daemon=True).start()
+
+    if hasattr(signal, "SIGUSR2"):
+        try:
+            signal.signal(signal.SIGUSR2, on_signal)
+        except ValueError:
+            pass  # not in the main thread; the HTTP trigger still works
+
+    # Per-request sampling hooks are only installed when configured
+    if request_rates and any(rate > 0 for rate in request_rates.values()):
+        os.makedirs(directory, exist_ok=True)
+        sampler = RequestSampler(directory, request_rates, hz)
+        atexit.register(sampler.flush)
+
+        @app.before_request
+        def maybe_profile_request():
+            request.environ["gormazar.profiled"] = sampler.begin(request.endpoint or "unknown")
+
+        @app.teardown_request
+        def end_profile_request(exc):
+            if request.environ.get("gormazar.profiled"):
+                sampler.end()
+
+    return profiler
@@ -0,0 +1,139 @@
+# ratelimit.py
+
+# Per-client rate limiting, so a misbehaving or malicious client cannot
+# inflate the scan and session counters or eat database capacity.
+# Requests are counted per route under two keys: the user_id (URL or
+# form; the session id on routes that take one instead) and the remote
+# address. Limits come from the rate_limits setting,
+# keyed by endpoint ("*" applies to every other route):
+#   "rate_limits": {
+#     "increment_counter": {"user": [60, 60], "addr": [600, 60]},
+#     "end_session":       {"user": [10, 60]}
+#   }
+# i.e. at most 60 requests per 60 seconds per user. Address limits
+# should stay generous: visitors on the castle Wi-Fi share one address.
+# A request over either limit gets 429 with a Retry-After header.
+#
+# Counting uses a sliding window: the count of the current fixed window
+# plus the previous window's count weighted by how much of it still
+# overlaps the last `seconds`. Two backends:
+#   memory – per process, an LRU-bounded dict (rate_limit_max_keys
+#            entries); limits apply per worker.
+#   mongo  – shared by every worker through the `rate_limits` collection,
+#            one atomic upsert per key and request; expired counters are
+#            removed by a TTL index.
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from flask import jsonify, request
+from pymongo import ReturnDocument
+
+RATE_LIMIT_COLLECTION = "rate_limits"
+DEFAULT_MAX_KEYS = 100000
+
+
+def _sliding(count, previous, elapsed, seconds):
+    return previous * (1 - elapsed / seconds) + count
+
+
+# -------------------------------------------------------------------
+# In-process backend
+# key -> [window number, count, previous count]
+# -------------------------------------------------------------------
+class MemoryBackend:
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, seconds, now):
+        window, elapsed = divmod(now, seconds)
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None:
+                state = self._windows[key] = [window, 0, 0]
+                if len(self._windows) > self.max_keys:
+                    self._windows.popitem(last=False)
+            else:
+                self._windows.move_to_end(key)
+                if state[0] != window:
+                    state[2] = state[1] if state[0] == window - 1 else 0
+                    state[0], state[1] = window, 0
+            if _sliding(state[1], state[2], elapsed, seconds) >= limit:
+                return False
+            state[1] += 1
+            return True
+
+
+# -------------------------------------------------------------------
+# Shared backend
+# One document per key, rolled over to the new window and incremented
+# in a single pipeline update. Unlike the memory backend, rejected
+# requests are counted too.
+# -------------------------------------------------------------------
+class MongoBackend:
+    def __init__(self, col):
+        self.col = col
+
+    def ensure_indexes(self):
+        self.col.create_index("expires_at", expireAfterSeconds=0)
+
+    def hit(self, key, limit, seconds, now):
+        window, elapsed = divmod(now, seconds)
+        same = {"$eq": ["$w", window]}
+        doc = self.col.find_one_and_update(
+            {"_id": key},
+            [{"$set": {
+                "p": {"$cond": [same, "$p", {"$cond": [{"$eq": ["$w", window - 1]}, "$n", 0]}]},
+                "n": {"$cond": [same, {"$add": ["$n", 1]}, 1]},
+                "w": window,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=2 * seconds),
+            }}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return _sliding(doc["n"] - 1, doc["p"], elapsed, seconds) < limit
+
+
+class RateLimiter:
+    def __init__(self, limits, backend):
+        self.limits = limits
+        self.backend = backend
+
+    def limits_for(self, endpoint):
+        return self.limits.get(endpoint, self.limits.get("*"))
+
+    # Returns None when allowed, else the seconds until a retry may pass
+    def check(self, endpoint, user_id, addr, now=None):
+        limits = self.limits_for(endpoint)
+        if not limits:
+            return None
+        now = time.time() if now is None else now
+        for kind, value in (("user", user_id), ("addr", addr)):
+            if kind not in limits or not value:
+                continue
+            limit, seconds = limits[kind]
+            if not self.backend.hit(f"{endpoint}:{kind}:{value}", limit, seconds, now):
+                return max(1, math.ceil(seconds - now % seconds))
+        return None
+
+
+def init_app(app, limiter):
+    @app.before_request
+    def rate_limit():
+        endpoint = request.endpoint
+        if endpoint is None or not limiter.limits_for(endpoint):
+            return None
+        view_args = request.view_args or {}
+        user_id = (view_args.get("user_id") or view_args.get("session_id")
+                   or request.form.get("user_id"))
+        retry_after = limiter.check(endpoint, user_id, request.remote_addr)
+        if retry_after is None:
+            return None
+        response = jsonify({"error": "Too many requests."})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(retry_after)
+        return response
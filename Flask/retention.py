@@ -0,0 +1,197 @@
+# retention.py
+
+# Tiered retention for user documents. Users that have not been seen for
+# a configurable time are moved from the hot `users` collection into
+# `users_archive`, keeping the working set of the API small. Archived
+# users are restored transparently when their device comes back.
+#
+# Global counters in the stats collection (unique_users, users_completed)
+# are never derived from the users collection, so archiving or restoring
+# a user leaves them untouched.
+import threading
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from pymongo import ReplaceOne
+from pymongo.errors import OperationFailure
+
+ARCHIVE_COLLECTION = "users_archive"
+DEFAULT_BATCH_SIZE = 500
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+# -------------------------------------------------------------------
+# Indexes
+#   users.user_id        – unique: every route looks users up by device
+#                          id, and registration upserts on it
+#   users.last_seen      – lets the archiver range-scan inactive users
+#   users_archive.user_id – restore lookups
+# Databases created before user_id was unique may hold duplicate users
+# left by overlapping registrations; they are merged first.
+# -------------------------------------------------------------------
+def ensure_indexes(users_col, archive_col):
+    existing = users_col.index_information().get("user_id_1")
+    if existing is None or not existing.get("unique"):
+        merge_duplicate_users(users_col)
+        if existing is not None:
+            try:
+                users_col.drop_index("user_id_1")
+            except OperationFailure:
+                pass  # another worker dropped it first
+    users_col.create_index("user_id", unique=True)
+    users_col.create_index("last_seen")
+    archive_col.create_index("user_id")
+
+
+# -------------------------------------------------------------------
+# Duplicate users
+# Folds every group of users sharing a user_id into its oldest document:
+# scanned lists are united, completed if any copy was, earliest
+# created_at and latest last_seen. Returns the number of documents
+# removed. Global counters are left as they are.
+# -------------------------------------------------------------------
+def merge_duplicate_users(users_col):
+    removed = 0
+    groups = users_col.aggregate([
+        {"$group": {"_id": "$user_id", "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}}
+    ], allowDiskUse=True)
+    for group in groups:
+        docs = sorted(users_col.find({"_id": {"$in": group["ids"]}}), key=lambda d: d["_id"])
+        if len(docs) < 2:
+            continue
+        keep, extra = docs[0], docs[1:]
+        scanned = []
+        for doc in docs:
+            scanned.extend(s for s in doc.get("scanned", []) if s not in scanned)
+        merged = {"scanned": scanned, "completed": any(d.get("completed", False) for d in docs)}
+        for field, pick in (("created_at", min), ("last_seen", max)):
+            values = [d[field] for d in docs if d.get(field) is not None]
+            if values:
+                merged[field] = pick(values)
+        users_col.update_one({"_id": keep["_id"]}, {"$set": merged})
+        removed += users_col.delete_many({"_id": {"$in": [d["_id"] for d in extra]}}).deleted_count
+    return removed
+
+
+# -------------------------------------------------------------------
+# Restore
+# Moves an archived user back into the hot collection. Returns True if
+# the user was found in the archive. The hot copy is written first so a
+# crash in between leaves a duplicate in the archive, never a lost user.
+# -------------------------------------------------------------------
+def restore_user(users_col, archive_col, user_id):
+    doc = archive_col.find_one({"user_id": user_id})
+    if doc is None:
+        return False
+    doc["last_seen"] = utcnow()
+    users_col.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+    archive_col.delete_one({"_id": doc["_id"]})
+    return True
+
+
+# -------------------------------------------------------------------
+# Archive one batch
+# Copies up to batch_size inactive users into the archive, then deletes
+# them from the hot collection only if they are still inactive. Users
+# that became active in between keep their hot document and their
+# archive copy is dropped again. Returns the number of users moved.
+# Users created before last_seen was tracked count as inactive.
+# -------------------------------------------------------------------
+def archive_batch(users_col, archive_col, cutoff, batch_size=DEFAULT_BATCH_SIZE):
+    inactive = {"$or": [{"last_seen": {"$lt": cutoff}}, {"last_seen": None}]}
+    docs = list(users_col.find(inactive, limit=batch_size))
+    if not docs:
+        return 0
+
+    ids = [doc["_id"] for doc in docs]
+    archive_col.bulk_write(
+        [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs],
+        ordered=False
+    )
+    moved = users_col.delete_many({"$and": [{"_id": {"$in": ids}}, inactive]}).deleted_count
+
+    if moved < len(ids):
+        still_hot = [d["_id"] for d in users_col.find({"_id": {"$in": ids}}, {"_id": 1})]
+        if still_hot:
+            archive_col.delete_many({"_id": {"$in": still_hot}})
+    return moved
+
+
+def archive_inactive(users_col, archive_col, max_age, batch_size=DEFAULT_BATCH_SIZE):
+    cutoff = utcnow() - max_age
+    total = 0
+    while True:
+        moved = archive_batch(users_col, archive_col, cutoff, batch_size)
+        total += moved
+        if moved == 0:
+            return total
+
+
+# -------------------------------------------------------------------
+# Background archiver
+# Daemon thread that runs a full archive pass every `interval` seconds.
+# Errors are logged and retried on the next pass.
+# -------------------------------------------------------------------
+class Archiver(threading.Thread):
+    def __init__(self, users_col, archive_col, max_age, interval, batch_size, logger,
+                 name="user-archiver"):
+        super().__init__(name=name, daemon=True)
+        self.users_col = users_col
+        self.archive_col = archive_col
+        self.max_age = max_age
+        self.interval = interval
+        self.batch_size = batch_size
+        self.logger = logger
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                moved = archive_inactive(self.users_col, self.archive_col,
+                                         self.max_age, self.batch_size)
+                if moved:
+                    self.logger.info("Archived %d inactive users", moved)
+            except Exception:
+                self.logger.exception("User archive pass failed")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+# -------------------------------------------------------------------
+# CLI command
+#   flask --app app archive-users --days 180 [--site id]
+# Runs a single archive pass in the foreground.
+# -------------------------------------------------------------------
+@click.command("archive-users")
+@click.option("--days", type=click.FloatRange(min=0, min_open=True), required=True,
+              help="Archive users inactive for more than this many days.")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True, type=click.IntRange(1))
+@click.option("--site", "site_id", default=None, help="Site to act on. Defaults to the default site.")
+@with_appcontext
+def archive_command(days, batch_size, site_id):
+    """Move inactive users into the archive collection."""
+    db = current_app.extensions["gormazar.sites"].for_cli(site_id).db
+    moved = archive_inactive(db["users"], db[ARCHIVE_COLLECTION],
+                             timedelta(days=days), batch_size)
+    click.echo(f"Archived {moved} inactive users")
+
+
+# Starts one archiver per site, each working on its own database
+def init_app(app, site_list, max_age_days=0, interval=3600, batch_size=DEFAULT_BATCH_SIZE):
+    app.cli.add_command(archive_command)
+    if max_age_days <= 0:
+        return []
+    archivers = []
+    for site in site_list:
+        archiver = Archiver(site.users_col, site.archive_col, timedelta(days=max_age_days),
+                            interval, batch_size, app.logger, name=f"user-archiver-{site.id}")
+        archiver.start()
+        archivers.append(archiver)
+    return archivers
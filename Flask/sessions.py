@@ -0,0 +1,288 @@
+# sessions.py
+
+# Server-side session lifecycle. /endSession only counts sessions whose
+# client reports a duration; crashed or killed apps never do, and nothing
+# says how many visitors are on site right now. Tracked sessions instead:
+#   POST /session/start/<user_id>         – opens a session, returns its id
+#   POST /session/heartbeat/<session_id>  – every heartbeat_interval seconds
+#   POST /session/end/<session_id>        – closes it (replaces /endSession)
+#   GET  /stats/live                      – live visitor gauge
+#
+# Heartbeats are absorbed in memory and written in one unordered bulk
+# write per flush (session_flush_seconds), never one write per heartbeat.
+# A background pass per site closes sessions without a heartbeat for
+# session_timeout_seconds as "expired", ending them at their last
+# heartbeat, and folds their durations into the site's session statistics
+# (sessions_count, average_session_time) like ended sessions. Closing is
+# conditional on the session still being open, so several workers may
+# sweep the same site safely. The timeout must stay well above the flush
+# interval, or heartbeats still buffered in another worker are missed.
+#
+# The session routes have default rate_limits, per user or session id
+# and per address, like /endSession.
+#
+# The live gauge counts sessions that started or sent a heartbeat to this
+# worker within live_window_seconds, from an in-memory sliding window.
+# Only sessions this worker started, or that a flush found still open,
+# are counted: heartbeats for unknown or closed ids never inflate it.
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from flask import g, jsonify
+from pymongo import ReturnDocument, UpdateOne
+
+import retention
+
+SESSIONS_COLLECTION = "sessions"
+SWEEP_BATCH_SIZE = 500
+
+
+# -------------------------------------------------------------------
+# Session statistics
+# Folds `count` sessions totalling `total` seconds into the running
+# average in one atomic update. Returns the new average.
+# -------------------------------------------------------------------
+def record_durations(stats_col, total, count=1):
+    stats = stats_col.find_one_and_update(
+        {"_id": "global"},
+        [{"$set": {
+            "average_session_time": {"$divide": [
+                {"$add": [{"$multiply": [{"$ifNull": ["$average_session_time", 0.0]},
+                                         {"$ifNull": ["$sessions_count", 0]}]}, total]},
+                {"$add": [{"$ifNull": ["$sessions_count", 0]}, count]}
+            ]},
+            "sessions_count": {"$add": [{"$ifNull": ["$sessions_count", 0]}, count]},
+        }}],
+        projection={"_id": 0, "average_session_time": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    return stats["average_session_time"] if stats else None
+
+
+def _close(state, until, **fields):
+    # Pipeline closing a session at `until` (a date or "$field")
+    return [{"$set": {
+        "state": state,
+        "ended_at": until,
+        "duration": {"$divide": [{"$subtract": [until, "$started_at"]}, 1000.0]},
+        **fields,
+    }}]
+
+
+class SessionTracker:
+    def __init__(self, sessions_col, stats_col, timeout, live_window):
+        self.sessions_col = sessions_col
+        self.stats_col = stats_col
+        self.timeout = timeout
+        self.live_window = live_window
+        self._lock = threading.Lock()
+        self._pending = {}   # session id -> (datetime, monotonic) of the latest heartbeat
+        self._live = {}      # known open session id -> monotonic time last seen
+        self._ended = {}     # session id ended here -> monotonic time, never re-added
+
+    def ensure_indexes(self):
+        self.sessions_col.create_index([("state", 1), ("last_heartbeat", 1)])
+
+    def _seen(self, session_id):
+        with self._lock:
+            self._live[session_id] = time.monotonic()
+
+    # ---------------------------------------------------------------
+    # Lifecycle
+    # ---------------------------------------------------------------
+    def start(self, user_id):
+        session_id = uuid.uuid4().hex
+        now = retention.utcnow()
+        self.sessions_col.insert_one({
+            "_id": session_id,
+            "user_id": user_id,
+            "state": "open",
+            "started_at": now,
+            "last_heartbeat": now
+        })
+        self._seen(session_id)
+        return session_id
+
+    # Sessions this worker does not know yet only join the live gauge
+    # once the next flush finds them open
+    def heartbeat(self, session_id):
+        now, seen = retention.utcnow(), time.monotonic()
+        with self._lock:
+            self._pending[session_id] = (now, seen)
+            if session_id in self._live:
+                self._live[session_id] = seen
+
+    # Returns (duration, new average session time), or None when the
+    # session is unknown or already closed
+    def end(self, session_id):
+        with self._lock:
+            self._pending.pop(session_id, None)
+            self._live.pop(session_id, None)
+            self._ended[session_id] = time.monotonic()
+        doc = self.sessions_col.find_one_and_update(
+            {"_id": session_id, "state": "open"},
+            _close("ended", retention.utcnow()),
+            projection={"_id": 0, "duration": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if doc is None:
+            return None
+        return doc["duration"], record_durations(self.stats_col, doc["duration"])
+
+    def live_count(self):
+        cutoff = time.monotonic() - self.live_window
+        with self._lock:
+            return sum(1 for seen in self._live.values() if seen >= cutoff)
+
+    # ---------------------------------------------------------------
+    # Background work
+    # ---------------------------------------------------------------
+    # Writes buffered heartbeats, then keeps in the live gauge only the
+    # sessions they were applied to. The open sessions are read back only
+    # when some update matched nothing or a session is new to this worker.
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            cutoff = time.monotonic() - self.live_window
+            self._live = {sid: seen for sid, seen in self._live.items() if seen >= cutoff}
+            self._ended = {sid: at for sid, at in self._ended.items() if at >= cutoff}
+            known = all(sid in self._live for sid in pending)
+        if not pending:
+            return 0
+        result = self.sessions_col.bulk_write(
+            [UpdateOne({"_id": sid, "state": "open"}, {"$max": {"last_heartbeat": at}})
+             for sid, (at, _) in pending.items()],
+            ordered=False
+        )
+        if not known or result.matched_count < len(pending):
+            open_ids = {doc["_id"] for doc in self.sessions_col.find(
+                {"_id": {"$in": list(pending)}, "state": "open"}, {"_id": 1})}
+            with self._lock:
+                for sid, (_, seen) in pending.items():
+                    if sid not in open_ids:
+                        self._live.pop(sid, None)
+                    elif sid not in self._ended:
+                        self._live[sid] = max(seen, self._live.get(sid, seen))
+        return len(pending)
+
+    # Closes stale sessions a batch at a time: one update_many per batch,
+    # tagged with this pass so that one aggregate sums exactly the
+    # sessions this pass closed, even when other workers sweep too
+    def sweep(self, batch_size=SWEEP_BATCH_SIZE):
+        cutoff = retention.utcnow() - timedelta(seconds=self.timeout)
+        stale = {"state": "open", "last_heartbeat": {"$lt": cutoff}}
+        sweep_id = uuid.uuid4().hex
+        close = _close("expired", "$last_heartbeat", sweep=sweep_id)
+        expired, total = 0, 0.0
+        while True:
+            ids = [doc["_id"] for doc in self.sessions_col.find(stale, {"_id": 1}, limit=batch_size)]
+            if not ids:
+                break
+            if self.sessions_col.update_many({"_id": {"$in": ids}, **stale}, close).modified_count:
+                for row in self.sessions_col.aggregate([
+                    {"$match": {"_id": {"$in": ids}, "sweep": sweep_id}},
+                    {"$group": {"_id": None, "count": {"$sum": 1}, "total": {"$sum": "$duration"}}}
+                ]):
+                    expired += row["count"]
+                    total += row["total"]
+            if len(ids) < batch_size:
+                break
+        if expired:
+            record_durations(self.stats_col, total, expired)
+        return expired
+
+
+# -------------------------------------------------------------------
+# Background maintainer
+# Daemon thread per site: flushes buffered heartbeats every
+# flush_interval and sweeps stale sessions every sweep_interval.
+# Errors are logged and retried on the next pass.
+# -------------------------------------------------------------------
+class SessionMaintainer(threading.Thread):
+    def __init__(self, tracker, flush_interval, sweep_interval, logger, name="session-maintainer"):
+        super().__init__(name=name, daemon=True)
+        self.tracker = tracker
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.logger = logger
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last_sweep = time.monotonic()
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.tracker.flush()
+                if time.monotonic() - last_sweep >= self.sweep_interval:
+                    last_sweep = time.monotonic()
+                    expired = self.tracker.sweep()
+                    if expired:
+                        self.logger.info("Expired %d stale sessions", expired)
+            except Exception:
+                self.logger.exception("Session maintenance pass failed")
+
+    def stop(self):
+        self._stop_event.set()
+        # Keep heartbeats received since the last flush
+        self.tracker.flush()
+
+
+def init_app(app, site_list, heartbeat_interval=30, flush_interval=10, sweep_interval=60):
+    # -----------------------------------------------------------------
+    # Route: Start Session
+    # POST /session/start/<user_id>
+    # Returns the new session id and how often to send heartbeats
+    # -----------------------------------------------------------------
+    def start_session(user_id):
+        session_id = g.site.sessions.start(user_id)
+        return jsonify({"session_id": session_id, "heartbeat_interval": heartbeat_interval}), 201
+
+    # -----------------------------------------------------------------
+    # Route: Session Heartbeat
+    # POST /session/heartbeat/<session_id>
+    # Buffered in memory; never touches Mongo on the request path
+    # -----------------------------------------------------------------
+    def session_heartbeat(session_id):
+        g.site.sessions.heartbeat(session_id)
+        return "", 204
+
+    # -----------------------------------------------------------------
+    # Route: End Session
+    # POST /session/end/<session_id>
+    # Duration is measured by the server from the session start
+    # -----------------------------------------------------------------
+    def end_tracked_session(session_id):
+        result = g.site.sessions.end(session_id)
+        if result is None:
+            return jsonify({"error": f"No open session {session_id}"}), 404
+        duration, average = result
+        return jsonify({"session_duration": duration, "average_session_time": average}), 200
+
+    # -----------------------------------------------------------------
+    # Route: Live Visitors
+    # GET /stats/live
+    # Sessions active on this worker within the live window
+    # -----------------------------------------------------------------
+    def live_visitors():
+        tracker = g.site.sessions
+        return jsonify({"live_visitors": tracker.live_count(),
+                        "window_seconds": tracker.live_window}), 200
+
+    for prefix in ('', '/sites/<site_id>'):
+        app.add_url_rule(prefix + '/session/start/<user_id>', 'start_session',
+                         start_session, methods=['POST'])
+        app.add_url_rule(prefix + '/session/heartbeat/<session_id>', 'session_heartbeat',
+                         session_heartbeat, methods=['POST'])
+        app.add_url_rule(prefix + '/session/end/<session_id>', 'end_tracked_session',
+                         end_tracked_session, methods=['POST'])
+        app.add_url_rule(prefix + '/stats/live', 'live_visitors',
+                         live_visitors, methods=['GET'])
+
+    maintainers = []
+    for site in site_list:
+        maintainer = SessionMaintainer(site.sessions, flush_interval, sweep_interval,
+                                       app.logger, name=f"session-maintainer-{site.id}")
+        maintainer.start()
+        maintainers.append(maintainer)
+    return maintainers
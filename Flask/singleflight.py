@@ -0,0 +1,110 @@
+# singleflight.py
+
+# Coalescing of concurrent identical reads. During a burst many request
+# threads of one worker read the same document at once (the graffiti doc
+# after its $inc, the global stats doc). With a Group, the first caller
+# for a key runs the query and every caller arriving while it is in
+# flight waits for and shares that result, so read load scales with the
+# number of distinct keys instead of the number of requests.
+#
+# Shared results are handed to every waiter: treat them as read-only.
+#
+# Read-your-writes: a caller that has just written the document passes
+# not_before (a time.monotonic() taken after the write was acknowledged)
+# and only joins a flight that started after it, so the shared result
+# always reflects its own write. A flight already in progress started
+# too early, so such callers queue behind it and share the next flight
+# for the key, which starts as soon as the current one finishes.
+#
+# Per-key metrics (calls, executed, shared, errors) are served at
+#   GET /admin/singleflight   (admin token required)
+import threading
+import time
+
+from flask import jsonify
+
+from admin import admin_required
+
+
+class _Flight:
+    __slots__ = ("started", "done", "result", "error", "next")
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.next = None     # flight queued behind this one
+
+
+class Group:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}   # key -> _Flight in progress
+        self._metrics = {}   # key -> {"calls", "executed", "shared", "errors"}
+
+    def do(self, key, fn, not_before=None):
+        with self._lock:
+            metrics = self._metrics.get(key)
+            if metrics is None:
+                metrics = self._metrics[key] = {"calls": 0, "executed": 0, "shared": 0, "errors": 0}
+            metrics["calls"] += 1
+            ahead = None
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            elif not_before is None or flight.started >= not_before:
+                leader = False
+            else:
+                # Started before the caller's write: share the next flight
+                ahead, flight = flight, flight.next
+                leader = flight is None
+                if leader:
+                    flight = ahead.next = _Flight()
+            metrics["executed" if leader else "shared"] += 1
+
+        if not leader:
+            flight.done.wait()
+        else:
+            if ahead is not None:
+                ahead.done.wait()
+            try:
+                flight.result = fn()
+            except BaseException as exc:
+                flight.error = exc
+            finally:
+                with self._lock:
+                    if self._flights.get(key) is flight:
+                        if flight.next is None:
+                            del self._flights[key]
+                        else:
+                            # Promote the queued flight; its leader starts now
+                            flight.next.started = time.monotonic()
+                            self._flights[key] = flight.next
+                    if flight.error is not None:
+                        metrics["errors"] += 1
+                flight.done.set()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def metrics(self):
+        with self._lock:
+            return {str(key): dict(values) for key, values in self._metrics.items()}
+
+
+def init_app(app, site_list):
+    # -----------------------------------------------------------------
+    # Route: Single-flight Metrics
+    # GET /admin/singleflight
+    # Per site and key: calls, queries executed, calls served from a
+    # shared flight, and failed flights
+    # -----------------------------------------------------------------
+    @admin_required
+    def singleflight_metrics():
+        return jsonify({site.id: site.flights.metrics() for site in site_list}), 200
+
+    app.add_url_rule('/admin/singleflight', 'singleflight_metrics',
+                     singleflight_metrics, methods=['GET'])
@@ -0,0 +1,182 @@
+# sites.py
+
+# Multi-site support: one API process serving several heritage sites.
+# Every site is partitioned into its own Mongo database, so catalogs,
+# users, statistics and indexes never mix, and a busy site cannot contend
+# with (or evict the cached working set of) a quiet one. Each site also
+# keeps its own in-process catalog cache and asset store.
+#
+# The default site uses mongo_database and answers the original,
+# unprefixed routes. Additional sites come from the `sites` setting:
+#   "sites": {
+#     "calatanazor": {
+#       "database": "CalatanazorAR",
+#       "graffiti": [{"id": "irlGate", "name": "Town gate"}],
+#       "assets_dir": "/srv/assets/calatanazor"
+#     }
+#   }
+# and are served under /sites/<site_id>/...
+import threading
+import time
+
+import click
+
+import assets
+import retention
+import sessions
+import singleflight
+import uniques
+import userquery
+
+
+class Site:
+    def __init__(self, site_id, db, settings, initial_graffiti=(), assets_dir=None,
+                 url_prefix=""):
+        self.id = site_id
+        self.db = db
+        self.settings = settings
+
+        # Collections for graffiti data, users, and global statistics
+        self.images_col  = db['graffiti']
+        self.users_col   = db['users']
+        self.stats_col   = db['stats']
+        # Cold storage for users that have been inactive for a long time
+        self.archive_col = db[retention.ARCHIVE_COLLECTION]
+        # HyperLogLog sketches of unique visitors per day and per graffiti
+        self.uniques_col = db['uniques']
+        # Tracked sessions (start / heartbeat / end)
+        self.sessions_col = db[sessions.SESSIONS_COLLECTION]
+
+        self.initial_graffiti = list(initial_graffiti)
+        self.assets = assets.AssetStore(
+            assets_dir or settings.assets_dir,
+            settings.bind(self.images_col, "catalog"),
+            settings.assets_cache_dir,
+            settings.assets_rescan_seconds,
+            url_prefix=url_prefix
+        )
+        self.uniques = uniques.UniqueVisitors(self.col("uniques", "scan"), self.col("uniques", "stats"))
+        self.sessions = sessions.SessionTracker(
+            self.col("sessions", "session"),
+            self.col("stats", "session"),
+            settings.session_timeout_seconds,
+            settings.live_window_seconds
+        )
+
+        # Concurrent identical reads share one query
+        self.flights = singleflight.Group()
+
+        self._catalog_lock = threading.Lock()
+        self._catalog = None  # (loaded_at, [{"id", "name"}, ...])
+
+    # Collection handle for an operation class, e.g. site.col("users", "scan")
+    def col(self, name, op_class):
+        return self.settings.bind(getattr(self, f"{name}_col"), op_class)
+
+    # ---------------------------------------------------------------
+    # Coalesced reads (see singleflight.py); results are shared between
+    # concurrent callers and must not be modified
+    # ---------------------------------------------------------------
+    def graffiti(self, doc_id, not_before=None):
+        return self.flights.do(
+            f"graffiti:{doc_id}",
+            lambda: self.col("images", "scan").find_one({"id": doc_id}),
+            not_before
+        )
+
+    def stats(self):
+        return self.flights.do(
+            "stats:global",
+            lambda: self.col("stats", "stats").find_one({"_id": "global"}, {"_id": 0})
+        )
+
+    # ---------------------------------------------------------------
+    # Initialize global statistics document if it does not exist
+    # Tracks:
+    #   - unique_users: how many distinct devices have registered
+    #   - users_completed: how many users have scanned all graffiti
+    #   - sessions_count: total number of sessions ended
+    #   - average_session_time: running average of session durations
+    #
+    # Ensure initial graffiti documents exist
+    # Each doc has:
+    #   id      – identifier matching the AR reference image name
+    #   name    – human-readable description
+    #   scans   – counter of total scans
+    # ---------------------------------------------------------------
+    def ensure_initialized(self):
+        retention.ensure_indexes(self.users_col, self.archive_col)
+        self.images_col.create_index("id")
+        self.sessions.ensure_indexes()
+        userquery.ensure_indexes(self.users_col)
+
+        if self.stats_col.count_documents({"_id": "global"}) == 0:
+            self.stats_col.insert_one({
+                "_id": "global",
+                "unique_users": 0,
+                "users_completed": 0,
+                "sessions_count": 0,
+                "average_session_time": 0.0
+            })
+
+        for doc in self.initial_graffiti:
+            if self.images_col.count_documents({"id": doc["id"]}, limit=1) == 0:
+                self.images_col.insert_one({"id": doc["id"], "name": doc["name"], "scans": 0,
+                                            **({"assets": doc["assets"]} if "assets" in doc else {})})
+
+    # ---------------------------------------------------------------
+    # Catalog cache
+    # Graffiti ids and names of this site, reloaded at most every
+    # assets_rescan_seconds. Used to decide when a user has completed
+    # the site without querying the catalog on every scan.
+    # ---------------------------------------------------------------
+    def catalog(self):
+        with self._catalog_lock:
+            now = time.monotonic()
+            if self._catalog is None or now - self._catalog[0] >= self.settings.assets_rescan_seconds:
+                docs = self.col("images", "catalog").find({}, {"_id": 0, "id": 1, "name": 1}).sort("id", 1)
+                self._catalog = (now, list(docs))
+            return self._catalog[1]
+
+
+class SiteRegistry:
+    def __init__(self, client, settings, default_graffiti):
+        self.default_id = settings.default_site
+        self._sites = {}
+
+        self.default = Site(self.default_id, client[settings.mongo_database], settings,
+                            default_graffiti)
+        self._sites[self.default_id] = self.default
+
+        for site_id, options in settings.sites.items():
+            if site_id == self.default_id:
+                raise ValueError(f"Site '{site_id}' clashes with the default site")
+            self._sites[site_id] = Site(
+                site_id,
+                client[options.get("database", f"{settings.mongo_database}_{site_id}")],
+                settings,
+                options.get("graffiti", ()),
+                options.get("assets_dir"),
+                url_prefix=f"/sites/{site_id}"
+            )
+
+    def get(self, site_id):
+        return self._sites.get(site_id)
+
+    def __iter__(self):
+        return iter(self._sites.values())
+
+    def ensure_initialized(self):
+        for site in self:
+            site.ensure_initialized()
+
+    # Site named by a CLI --site option (None means the default site)
+    def for_cli(self, site_id):
+        site = self.get(site_id or self.default_id)
+        if site is None:
+            raise click.BadParameter(f"Unknown site '{site_id}'", param_hint="--site")
+        return site
+
+
+def init_app(app, registry):
+    app.extensions["gormazar.sites"] = registry
@@ -0,0 +1,212 @@
+# slowops.py
+
+# Slow-operation log for the Mongo data layer. A pymongo CommandListener
+# sees every command the routes send; any command slower than the
+# configured threshold is logged (logger "gormazar.slowops") with:
+#   - the route (Flask endpoint) that issued it
+#   - the filter shape, with every value replaced by "?"
+#   - its duration
+# For each distinct command shape an `explain` (executionStats) is run in
+# the background at most once per explain interval, so the log shows
+# COLLSCAN vs IXSCAN and how many keys/documents were examined.
+# The most recent entries are kept in memory and served at
+#   GET /admin/slow-ops   (admin token required)
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from flask import has_request_context, jsonify, request
+from pymongo import monitoring
+
+from admin import admin_required
+
+logger = logging.getLogger("gormazar.slowops")
+
+# Commands that can be explained, with the field holding their filter
+FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "aggregate": "pipeline",
+    "update": "updates",
+    "delete": "deletes",
+}
+IGNORED_COMMANDS = {"explain", "hello", "isMaster", "ismaster", "ping", "endSessions",
+                    "saslStart", "saslContinue", "buildInfo", "getLastError"}
+
+
+# -------------------------------------------------------------------
+# Redaction
+# Keeps keys and operators, replaces every value with "?". Lists of
+# scalars (e.g. $in) collapse to a single placeholder so their length is
+# not part of the shape; lists of sub-documents ($or, pipelines) are kept.
+# -------------------------------------------------------------------
+def redact(value):
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, dict) for item in value):
+            return [redact(item) for item in value]
+        return ["?"]
+    return "?"
+
+
+def filter_shape(command_name, command):
+    field = FILTER_FIELDS.get(command_name)
+    if field is None:
+        return None
+    value = command.get(field)
+    if command_name == "update" and value:
+        return {"q": redact(value[0].get("q", {})), "u": redact(value[0].get("u", {}))}
+    if command_name == "delete" and value:
+        return {"q": redact(value[0].get("q", {}))}
+    return redact(value) if value is not None else {}
+
+
+def explainable_command(command_name, command):
+    # Explain the first statement of a batched write only
+    explained = {key: value for key, value in command.items()
+                 if not key.startswith("$") and key not in ("lsid", "txnNumber", "writeConcern",
+                                                            "readConcern", "ordered")}
+    for field in ("updates", "deletes"):
+        if command_name in ("update", "delete") and field in explained:
+            explained[field] = explained[field][:1]
+    return explained
+
+
+# -------------------------------------------------------------------
+# Plan summary: stages of the winning plan and execution counters
+# -------------------------------------------------------------------
+def _stages(plan):
+    stages = []
+    while plan:
+        stages.append(plan.get("stage"))
+        children = plan.get("inputStages")
+        if children:
+            for child in children:
+                stages.extend(_stages(child))
+            break
+        plan = plan.get("inputStage") or plan.get("queryPlan")
+    return [stage for stage in stages if stage]
+
+
+def summarize_explain(result):
+    planner = result.get("queryPlanner", {})
+    if not planner and "stages" in result:
+        # Aggregations wrap the planner output in their first stage
+        first = result["stages"][0].get("$cursor", {})
+        planner, result = first.get("queryPlanner", {}), first
+    winning = planner.get("winningPlan", {})
+    stages = _stages(winning.get("queryPlan", winning))
+    stats = result.get("executionStats", {})
+    return {
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "n_returned": stats.get("nReturned"),
+    }
+
+
+class SlowOpRecorder(monitoring.CommandListener):
+    def __init__(self, threshold_ms, explain_interval=60.0, history=200):
+        self.threshold_us = threshold_ms * 1000
+        self.explain_interval = explain_interval
+        self.client = None
+        self.recent = deque(maxlen=history)
+        self._started = {}          # (connection, request id) -> (command, route)
+        self._explained_at = {}     # shape key -> monotonic time of last explain
+        self._explain_queue = queue.Queue(maxsize=100)
+        if explain_interval > 0:
+            threading.Thread(target=self._explain_worker, name="slowop-explain", daemon=True).start()
+
+    # ---------------------------------------------------------------
+    # CommandListener callbacks (run on the thread issuing the command)
+    # ---------------------------------------------------------------
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        route = request.endpoint if has_request_context() else None
+        self._started[(event.connection_id, event.request_id)] = (event.command, route)
+
+    def succeeded(self, event):
+        self._finished(event, None)
+
+    def failed(self, event):
+        self._finished(event, getattr(event, "failure", {}))
+
+    def _finished(self, event, failure):
+        started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is None or event.duration_micros < self.threshold_us:
+            return
+        command, route = started
+        name = event.command_name
+        entry = {
+            "at": time.time(),
+            "route": route,
+            "database": event.database_name,
+            "collection": command.get(name),
+            "command": name,
+            "filter": filter_shape(name, command),
+            "duration_ms": round(event.duration_micros / 1000.0, 3),
+        }
+        if failure is not None:
+            # errmsg may quote document values (e.g. an E11000 dup key), so
+            # only the error code is logged
+            if isinstance(failure, dict):
+                entry["error"] = {"code": failure.get("code"), "codeName": failure.get("codeName", "failed")}
+            else:
+                entry["error"] = {"code": None, "codeName": type(failure).__name__}
+        self.recent.append(entry)
+        logger.warning("slow mongo op %s", json.dumps(entry, default=str, sort_keys=True))
+        self._maybe_explain(entry, command)
+
+    # ---------------------------------------------------------------
+    # Explain, rate-limited per command shape and run off the request path
+    # ---------------------------------------------------------------
+    def _maybe_explain(self, entry, command):
+        if self.explain_interval <= 0 or self.client is None or entry["command"] not in FILTER_FIELDS:
+            return
+        key = json.dumps([entry["database"], entry["collection"], entry["command"], entry["filter"]],
+                         sort_keys=True, default=str)
+        now = time.monotonic()
+        last = self._explained_at.get(key)
+        if last is not None and now - last < self.explain_interval:
+            return
+        self._explained_at[key] = now
+        try:
+            self._explain_queue.put_nowait((entry, explainable_command(entry["command"], command)))
+        except queue.Full:
+            pass
+
+    def _explain_worker(self):
+        while True:
+            entry, command = self._explain_queue.get()
+            try:
+                result = self.client[entry["database"]].command(
+                    "explain", command, verbosity="executionStats")
+                entry["plan"] = summarize_explain(result)
+                logger.warning("slow mongo op plan %s", json.dumps(entry, default=str, sort_keys=True))
+            except Exception as exc:
+                # Same as failed commands: the message may quote values
+                error = getattr(exc, "code", None) or type(exc).__name__
+                entry["plan"] = {"error": error}
+                logger.info("explain failed for %s: %s", entry["command"], error)
+
+
+def init_app(app, recorder):
+    # -----------------------------------------------------------------
+    # Route: Slow Operations
+    # GET /admin/slow-ops
+    # Most recent slow commands, newest first, with plans once explained
+    # -----------------------------------------------------------------
+    @admin_required
+    def slow_ops():
+        return jsonify({"threshold_ms": recorder.threshold_us / 1000.0,
+                        "operations": list(reversed(recorder.recent))}), 200
+
+    app.add_url_rule('/admin/slow-ops', 'slow_ops', slow_ops, methods=['GET'])
@@ -0,0 +1,8 @@
+# conftest.py
+
+# Makes the Flask application modules (app, settings, slowops, ...)
+# importable from the tests.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,279 @@
+# test_query_plans.py
+
+# Query-plan regression tests. Every route of app.py is exercised against
+# a local mongod whose users collection is seeded with a large synthetic
+# population. All commands a route issues are captured with a pymongo
+# CommandListener and explained; a route fails if any of its queries does
+# a collection scan or examines more documents than MAX_DOCS_RATIO times
+# the documents it returns/modifies.
+#
+# Requires a reachable mongod (MONGO_TEST_URI, default
+# mongodb://localhost:27017/); the module is skipped otherwise.
+#   PLAN_TEST_USERS   – number of synthetic users to seed (default 20000)
+#   PLAN_TEST_RATIO   – allowed docs examined per doc returned (default 2)
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+
+import slowops
+
+MONGO_URI = os.environ.get("MONGO_TEST_URI", "mongodb://localhost:27017/")
+DATABASE = "GormazAR_plan_test"
+SYNTHETIC_USERS = int(os.environ.get("PLAN_TEST_USERS", 20000))
+MAX_DOCS_RATIO = float(os.environ.get("PLAN_TEST_RATIO", 2))
+
+
+def _mongo_available():
+    try:
+        MongoClient(MONGO_URI, serverSelectionTimeoutMS=1000).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+
+pytestmark = pytest.mark.skipif(not _mongo_available(), reason=f"no mongod at {MONGO_URI}")
+
+
+# -------------------------------------------------------------------
+# Command capture
+# Registered globally before app.py creates its client, so every command
+# the app sends passes through it. Only records while `active` is set.
+# -------------------------------------------------------------------
+class CommandCapture(monitoring.CommandListener):
+    def __init__(self):
+        self.active = False
+        self.commands = []
+
+    def started(self, event):
+        if self.active and event.command_name in slowops.FILTER_FIELDS:
+            self.commands.append((event.database_name, event.command_name, dict(event.command)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+capture = CommandCapture()
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    admin = MongoClient(MONGO_URI)
+    admin.drop_database(DATABASE)
+
+    # Restored when the module finishes; files the app writes go to temp dirs
+    with pytest.MonkeyPatch.context() as env:
+        for name, value in {
+            "MONGO_URI": MONGO_URI,
+            "MONGO_DATABASE": DATABASE,
+            "SITES": "{}",
+            "SLOW_OP_MS": "-1",
+            "ARCHIVE_AFTER_DAYS": "0",
+            "RATE_LIMITS": "{}",
+            "ADMIN_TOKEN": "plan-test",
+            "METRICS_DIR": str(tmp_path_factory.mktemp("metrics")),
+            "PROFILE_DIR": str(tmp_path_factory.mktemp("profiles")),
+            "ASSETS_CACHE_DIR": str(tmp_path_factory.mktemp("asset-cache")),
+        }.items():
+            env.setenv(name, value)
+        monitoring.register(capture)
+        import app
+
+        # Seed a large synthetic users collection, a fraction of it archived
+        users = admin[DATABASE]["users"]
+        # Every tenth user predates created_at; one in a thousand found irlMonk
+        batch = []
+        registered = datetime(2024, 4, 1, tzinfo=timezone.utc)
+        for i in range(SYNTHETIC_USERS):
+            user = {"user_id": uuid.uuid4().hex, "scanned": ["irlSoldier"] if i % 3 else [],
+                    "completed": False}
+            if i % 1000 == 1:
+                user["scanned"] = ["irlSoldier", "irlMonk"]
+            if i % 10:
+                user["created_at"] = registered + timedelta(seconds=i)
+            batch.append(user)
+            if len(batch) == 5000:
+                users.insert_many(batch)
+                batch = []
+        if batch:
+            users.insert_many(batch)
+        admin[DATABASE]["users_archive"].insert_many(
+            [{"user_id": uuid.uuid4().hex, "scanned": [], "completed": False} for _ in range(1000)])
+
+        yield app
+        admin.drop_database(DATABASE)
+        admin.close()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def explain(database, command_name, command):
+    explained = slowops.explainable_command(command_name, command)
+    result = MongoClient(MONGO_URI)[database].command("explain", explained, verbosity="executionStats")
+    return slowops.summarize_explain(result)
+
+
+def assert_efficient(send):
+    capture.commands = []
+    capture.active = True
+    try:
+        response = send()
+    finally:
+        capture.active = False
+    assert response.status_code < 500, response.data
+
+    problems = []
+    for database, command_name, command in capture.commands:
+        plan = explain(database, command_name, command)
+        shape = json.dumps(slowops.filter_shape(command_name, command), sort_keys=True)
+        returned = max(plan["n_returned"] or 0, 1)
+        if plan["collscan"]:
+            problems.append(f"{command_name} {command[command_name]} {shape}: COLLSCAN")
+        elif (plan["docs_examined"] or 0) > MAX_DOCS_RATIO * returned:
+            problems.append(f"{command_name} {command[command_name]} {shape}: examined "
+                            f"{plan['docs_examined']} docs for {returned} returned")
+    assert not problems, "\n".join(problems)
+    return response
+
+
+# -------------------------------------------------------------------
+# Routes
+# -------------------------------------------------------------------
+def test_home(client):
+    assert_efficient(lambda: client.get("/"))
+
+
+def test_stats(client):
+    assert_efficient(lambda: client.get("/stats"))
+
+
+def test_register_new_user(client):
+    response = assert_efficient(lambda: client.post(f"/registerUser/{uuid.uuid4().hex}"))
+    assert response.status_code == 201
+
+
+def test_register_known_user(client):
+    user_id = uuid.uuid4().hex
+    client.post(f"/registerUser/{user_id}")
+    response = assert_efficient(lambda: client.post(f"/registerUser/{user_id}"))
+    assert response.status_code == 200
+
+
+def test_register_archived_user(client, app_module):
+    user_id = uuid.uuid4().hex
+    app_module.site_registry.default.archive_col.insert_one(
+        {"user_id": user_id, "scanned": [], "completed": False})
+    response = assert_efficient(lambda: client.post(f"/registerUser/{user_id}"))
+    assert response.status_code == 200
+
+
+def test_bootstrap_new_user(client):
+    response = assert_efficient(lambda: client.post(f"/bootstrap/{uuid.uuid4().hex}"))
+    assert response.status_code == 201
+
+
+def test_bootstrap_overlapping_new_user(client, app_module):
+    user_id = uuid.uuid4().hex
+    stats = app_module.site_registry.default.stats_col
+    before = stats.find_one({"_id": "global"}).get("unique_users", 0)
+    with ThreadPoolExecutor(8) as pool:
+        codes = list(pool.map(lambda _: client.post(f"/bootstrap/{user_id}").status_code, range(8)))
+    assert codes.count(201) == 1 and codes.count(200) == 7
+    assert app_module.site_registry.default.users_col.count_documents({"user_id": user_id}) == 1
+    assert stats.find_one({"_id": "global"})["unique_users"] == before + 1
+
+
+def test_bootstrap_returning_user(client):
+    user_id = uuid.uuid4().hex
+    client.post(f"/registerUser/{user_id}")
+    client.post("/increment/irlSoldier", data={"user_id": user_id})
+    response = assert_efficient(lambda: client.post(f"/bootstrap/{user_id}"))
+    assert response.status_code == 200
+    assert response.get_json()["scanned"] == ["irlSoldier"]
+
+
+def test_increment(client):
+    user_id = uuid.uuid4().hex
+    client.post(f"/registerUser/{user_id}")
+    assert_efficient(lambda: client.post("/increment/irlSoldier", data={"user_id": user_id}))
+
+
+def test_increment_unknown_user(client):
+    response = assert_efficient(lambda: client.post("/increment/irlSoldier",
+                                                    data={"user_id": uuid.uuid4().hex}))
+    assert response.status_code == 404
+
+
+def test_increment_completing_user(client):
+    user_id = uuid.uuid4().hex
+    client.post(f"/registerUser/{user_id}")
+    client.post("/increment/irlSoldier", data={"user_id": user_id})
+    client.post("/increment/irlDate", data={"user_id": user_id})
+    response = assert_efficient(lambda: client.post("/increment/irlMonk", data={"user_id": user_id}))
+    assert len(response.get_json()["user_scanned"]) == 3
+
+
+def test_end_session(client):
+    user_id = uuid.uuid4().hex
+    client.post(f"/registerUser/{user_id}")
+    assert_efficient(lambda: client.post(f"/endSession/{user_id}", data={"duration": "42.0"}))
+
+
+def test_tracked_session(client, app_module):
+    session_id = client.post(f"/session/start/{uuid.uuid4().hex}").get_json()["session_id"]
+    client.post(f"/session/heartbeat/{session_id}")
+    app_module.site_registry.default.sessions.flush()
+    response = assert_efficient(lambda: client.post(f"/session/end/{session_id}"))
+    assert response.status_code == 200
+
+
+def test_live_gauge_ignores_unknown_sessions(client, app_module):
+    tracker = app_module.site_registry.default.sessions
+    before = client.get("/stats/live").get_json()["live_visitors"]
+    ended = client.post(f"/session/start/{uuid.uuid4().hex}").get_json()["session_id"]
+    client.post(f"/session/end/{ended}")
+    client.post(f"/session/heartbeat/{ended}")
+    client.post(f"/session/heartbeat/{uuid.uuid4().hex}")
+    assert_efficient(lambda: (tracker.flush(), client.get("/stats/live"))[1])
+    assert client.get("/stats/live").get_json()["live_visitors"] == before
+
+
+def test_unique_visitors(client):
+    assert_efficient(lambda: client.get("/stats/uniques?graffiti=irlSoldier"))
+
+
+# asc starts with the users without created_at, desc with the dated ones
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_admin_users_deep_page(client, order):
+    headers = {"Authorization": "Bearer plan-test"}
+    query = f"/admin/users?completed=false&limit=100&order={order}"
+    page = client.get(query, headers=headers).get_json()
+    for _ in range(5):
+        page = client.get(f"{query}&cursor={page['next']}", headers=headers).get_json()
+    response = assert_efficient(lambda: client.get(f"{query}&cursor={page['next']}", headers=headers))
+    users = response.get_json()["users"]
+    assert len(users) == 100
+    assert all((user["created_at"] is None) == (order == "asc") for user in users)
+
+
+def test_admin_users_rarely_scanned(client):
+    headers = {"Authorization": "Bearer plan-test"}
+    query = "/admin/users?scanned=irlMonk&limit=5&order=desc"
+    page = client.get(query, headers=headers).get_json()
+    response = assert_efficient(lambda: client.get(f"{query}&cursor={page['next']}", headers=headers))
+    assert all("irlMonk" in user["scanned"] for user in response.get_json()["users"])
+
+
+def test_asset_manifest(client):
+    assert_efficient(lambda: client.get("/assets/manifest"))
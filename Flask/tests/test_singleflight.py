@@ -0,0 +1,84 @@
+# test_singleflight.py
+
+# Coalescing tests for singleflight.Group. No mongod needed: the "query"
+# reads an in-memory counter that every caller increments first, like
+# /increment reading the graffiti doc after its $inc.
+import itertools
+import threading
+import time
+
+import singleflight
+
+CALLERS = 50
+
+
+def run_burst(not_before):
+    group = singleflight.Group()
+    counter = itertools.count(1)
+    written = {"value": 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(CALLERS)
+    stale = []
+
+    def read():
+        time.sleep(0.01)   # slow enough for callers to pile up
+        with lock:
+            return written["value"]
+
+    def caller():
+        barrier.wait()
+        with lock:
+            mine = written["value"] = next(counter)
+        result = group.do("graffiti:irlDate", read, time.monotonic() if not_before else None)
+        if result < mine:
+            stale.append((mine, result))
+
+    threads = [threading.Thread(target=caller) for _ in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return group.metrics()["graffiti:irlDate"], stale
+
+
+def test_read_after_write_callers_share_flights():
+    metrics, stale = run_burst(not_before=True)
+    assert metrics["calls"] == CALLERS
+    assert metrics["shared"] > 0
+    assert metrics["executed"] + metrics["shared"] == CALLERS
+    assert not stale, f"results older than the caller's own write: {stale[:5]}"
+
+
+def test_plain_callers_share_one_flight():
+    metrics, _ = run_burst(not_before=False)
+    assert metrics["shared"] > 0
+
+
+def test_errors_reach_every_caller():
+    group = singleflight.Group()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        release.wait()
+        raise RuntimeError("boom")
+
+    def caller():
+        try:
+            group.do("stats", fail)
+        except RuntimeError as exc:
+            errors.append(exc)
+
+    first = threading.Thread(target=caller)
+    first.start()
+    started.wait()
+    second = threading.Thread(target=caller)
+    second.start()
+    time.sleep(0.01)
+    release.set()
+    first.join()
+    second.join()
+    assert len(errors) == 2
+    assert group.metrics()["stats"]["errors"] == 1
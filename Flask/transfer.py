@@ -0,0 +1,202 @@
+# transfer.py
+
+# Bulk export and import of the GormazAR collections as NDJSON files.
+# Documents are streamed through cursor batches one line at a time, so
+# memory use stays constant however many users are stored.
+import gzip
+import os
+
+import click
+from bson import json_util
+from flask import current_app
+from flask.cli import with_appcontext
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+import retention
+
+# Collections that make up a full backup, in the order they are handled
+COLLECTIONS = ("users", retention.ARCHIVE_COLLECTION, "graffiti", "stats")
+
+# Documents fetched per cursor round trip / written per bulk_write call
+DEFAULT_BATCH_SIZE = 1000
+
+# Canonical Extended JSON keeps ObjectId, datetime and int/float types intact
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+
+
+# -------------------------------------------------------------------
+# Helpers
+# -------------------------------------------------------------------
+
+def _dump_path(directory, name, compress):
+    return os.path.join(directory, f"{name}.ndjson" + (".gz" if compress else ""))
+
+
+def _find_dump(directory, name):
+    # Prefer the compressed dump when both are present
+    for candidate in (_dump_path(directory, name, True), _dump_path(directory, name, False)):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def _open_text(path, mode, compress=None):
+    if compress is None:
+        compress = path.endswith(".gz")
+    if compress:
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return int(fh.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _write_checkpoint(path, lines_done):
+    # Write-then-rename so an interrupted import never leaves a torn checkpoint
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        fh.write(str(lines_done))
+    os.replace(tmp_path, path)
+
+
+# -------------------------------------------------------------------
+# Export
+# Streams every document of a collection, ordered by _id, into an
+# NDJSON file. The file is written under a temporary name and renamed
+# at the end so a partial export is never mistaken for a complete one.
+# -------------------------------------------------------------------
+def export_collection(col, path, batch_size=DEFAULT_BATCH_SIZE):
+    tmp_path = path + ".part"
+    count = 0
+    with _open_text(tmp_path, "w", path.endswith(".gz")) as out:
+        cursor = col.find({}, batch_size=batch_size).sort("_id", 1)
+        try:
+            for doc in cursor:
+                out.write(json_util.dumps(doc, json_options=JSON_OPTIONS))
+                out.write("\n")
+                count += 1
+        finally:
+            cursor.close()
+    os.replace(tmp_path, path)
+    return count
+
+
+# -------------------------------------------------------------------
+# Import
+# Replays an NDJSON dump into a collection with unordered bulk_write
+# batches. Each document is upserted by _id, so replaying a batch is
+# harmless. The number of lines already applied is stored next to the
+# dump, which lets an interrupted import resume where it stopped.
+# -------------------------------------------------------------------
+def import_collection(col, path, batch_size=DEFAULT_BATCH_SIZE, restart=False):
+    checkpoint_path = path + ".progress"
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    skip = _read_checkpoint(checkpoint_path)
+
+    lines_done = 0
+    written = 0
+    batch = []
+
+    def flush():
+        nonlocal written
+        if not batch:
+            return
+        try:
+            col.bulk_write(batch, ordered=False)
+        except BulkWriteError as exc:
+            errors = exc.details.get("writeErrors", [])
+            raise click.ClickException(
+                f"{len(errors)} write errors in batch ending at line {lines_done} "
+                f"of {path}; first: {errors[0].get('errmsg') if errors else exc}"
+            )
+        written += len(batch)
+        batch.clear()
+        _write_checkpoint(checkpoint_path, lines_done)
+
+    with _open_text(path, "r") as src:
+        for line in src:
+            lines_done += 1
+            if lines_done <= skip:
+                continue
+            line = line.strip()
+            if not line:
+                continue
+            doc = json_util.loads(line, json_options=JSON_OPTIONS)
+            batch.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+
+    # Import finished: the checkpoint is no longer needed
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return skip, written
+
+
+# -------------------------------------------------------------------
+# CLI commands
+#   flask --app app export-data <dir> [--gzip] [--site id] [-c users ...]
+#   flask --app app import-data <dir> [--restart] [--site id] [-c users ...]
+# -------------------------------------------------------------------
+collection_option = click.option(
+    "-c", "--collection", "collections", multiple=True,
+    type=click.Choice(COLLECTIONS),
+    help="Collection to process (repeatable). Defaults to all of them.",
+)
+site_option = click.option(
+    "--site", "site_id", default=None,
+    help="Site to act on. Defaults to the default site.",
+)
+batch_option = click.option(
+    "--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True, type=click.IntRange(1),
+    help="Documents per cursor batch / bulk_write call.",
+)
+
+
+@click.command("export-data")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--gzip", "compress", is_flag=True, help="Write .ndjson.gz files.")
+@collection_option
+@batch_option
+@site_option
+@with_appcontext
+def export_command(directory, compress, collections, batch_size, site_id):
+    """Stream collections into NDJSON files."""
+    db = current_app.extensions["gormazar.sites"].for_cli(site_id).db
+    os.makedirs(directory, exist_ok=True)
+    for name in collections or COLLECTIONS:
+        path = _dump_path(directory, name, compress)
+        count = export_collection(db[name], path, batch_size)
+        click.echo(f"{name}: exported {count} documents to {path}")
+
+
+@click.command("import-data")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option("--restart", is_flag=True, help="Ignore saved progress and import from the start.")
+@collection_option
+@batch_option
+@site_option
+@with_appcontext
+def import_command(directory, restart, collections, batch_size, site_id):
+    """Load NDJSON files written by export-data, resuming if interrupted."""
+    db = current_app.extensions["gormazar.sites"].for_cli(site_id).db
+    for name in collections or COLLECTIONS:
+        path = _find_dump(directory, name)
+        if path is None:
+            click.echo(f"{name}: no dump found in {directory}, skipping")
+            continue
+        skipped, written = import_collection(db[name], path, batch_size, restart)
+        resumed = f" (resumed after line {skipped})" if skipped else ""
+        click.echo(f"{name}: imported {written} documents from {path}{resumed}")
+
+
+def init_app(app):
+    app.cli.add_command(export_command)
+    app.cli.add_command(import_command)
@@ -0,0 +1,167 @@
+# uniques.py
+
+# Unique-visitor counts per day and per graffiti with HyperLogLog sketches.
+# unique_users in the stats document only counts devices ever registered;
+# counting distinct users over a date range from the users collection
+# would scan it. Instead every site keeps one sketch per UTC day and one
+# per (graffiti, day) in its `uniques` collection:
+#   {"_id": "day:2026-10-19", "day": "2026-10-19", "r": {"17": 3, ...}}
+#   {"_id": "graffiti:irlDate:2026-10-19", "graffiti": "irlDate", ...}
+#
+# A sketch has M = 2**P registers. A user id hashes to one register and a
+# rank (leading zeros + 1 of the remaining hash bits); recording a visit
+# is a single `$max` on that register, which is atomic and idempotent, so
+# concurrent workers never need to coordinate. A sketch never grows past
+# M registers however many visitors it counts.
+#
+# The union of any set of days (and of days across graffiti) is the
+# register-wise maximum of their sketches, so a weekly or arbitrary
+# range count is exactly as accurate as a daily one:
+#   P = 10, M = 1024 registers, standard error 1.04 / sqrt(M) ~= 3.25%
+#   (about 95% of estimates fall within +-6.5% of the true count).
+# Small counts use linear counting and are close to exact.
+#
+#   GET /stats/uniques?from=YYYY-MM-DD&to=YYYY-MM-DD[&graffiti=<id>]
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+
+from flask import jsonify, request
+from pymongo import UpdateOne
+
+P = 10
+M = 1 << P
+STANDARD_ERROR = 1.04 / math.sqrt(M)
+MAX_RANGE_DAYS = 366
+KNOWN_CACHE_BUCKETS = 256
+
+
+def register_for(user_id):
+    value = int.from_bytes(hashlib.blake2b(user_id.encode("utf-8"), digest_size=8).digest(), "big")
+    index = value >> (64 - P)
+    rest = value & ((1 << (64 - P)) - 1)
+    rank = (64 - P) - rest.bit_length() + 1
+    return index, rank
+
+
+def estimate(registers):
+    # registers: sequence of M ints
+    alpha = 0.7213 / (1 + 1.079 / M)
+    raw = alpha * M * M / sum(2.0 ** -r for r in registers)
+    zeros = registers.count(0)
+    if raw <= 2.5 * M and zeros:
+        return M * math.log(M / zeros)
+    return raw
+
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+def day_id(day):
+    return f"day:{day.isoformat()}"
+
+
+def graffiti_id(graffiti, day):
+    return f"graffiti:{graffiti}:{day.isoformat()}"
+
+
+class UniqueVisitors:
+    def __init__(self, write_col, read_col):
+        self.write_col = write_col
+        self.read_col = read_col
+        # Highest rank already written per (bucket, register); lets most
+        # visits skip the write entirely. Only recent buckets are kept.
+        self._known = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------------------------
+    # Recording
+    # ---------------------------------------------------------------
+    def _needs_write(self, bucket, index, rank):
+        with self._lock:
+            known = self._known.get(bucket)
+            return known is None or known[index] < rank
+
+    # Called only once the write is acknowledged, so a failed write is
+    # retried by the next visit with the same register
+    def _written(self, bucket, index, rank):
+        with self._lock:
+            known = self._known.get(bucket)
+            if known is None:
+                known = self._known[bucket] = bytearray(M)
+                if len(self._known) > KNOWN_CACHE_BUCKETS:
+                    self._known.popitem(last=False)
+            else:
+                self._known.move_to_end(bucket)
+            known[index] = max(known[index], rank)
+
+    def record(self, user_id, graffiti=None, day=None):
+        day = day or utc_today()
+        index, rank = register_for(user_id)
+        buckets = [(day_id(day), {"day": day.isoformat()})]
+        if graffiti is not None:
+            buckets.append((graffiti_id(graffiti, day), {"day": day.isoformat(), "graffiti": graffiti}))
+
+        pending = [(bucket, fields) for bucket, fields in buckets
+                   if self._needs_write(bucket, index, rank)]
+        if not pending:
+            return
+        self.write_col.bulk_write([
+            UpdateOne({"_id": bucket},
+                      {"$max": {f"r.{index}": rank}, "$setOnInsert": fields},
+                      upsert=True)
+            for bucket, fields in pending
+        ], ordered=False)
+        for bucket, _ in pending:
+            self._written(bucket, index, rank)
+
+    # ---------------------------------------------------------------
+    # Queries
+    # ---------------------------------------------------------------
+    def count(self, start, end, graffiti=None):
+        days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+        ids = [graffiti_id(graffiti, d) if graffiti is not None else day_id(d) for d in days]
+        union = [0] * M
+        daily = {}
+        for doc in self.read_col.find({"_id": {"$in": ids}}, {"_id": 0, "day": 1, "r": 1}):
+            registers = [0] * M
+            for index, rank in doc.get("r", {}).items():
+                registers[int(index)] = rank
+                if rank > union[int(index)]:
+                    union[int(index)] = rank
+            daily[doc["day"]] = round(estimate(registers))
+        return {
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "graffiti": graffiti,
+            "unique_visitors": round(estimate(union)),
+            "daily": {d.isoformat(): daily.get(d.isoformat(), 0) for d in days},
+            "standard_error": round(STANDARD_ERROR, 4),
+        }
+
+
+def init_app(app, counter_for_request):
+    # -----------------------------------------------------------------
+    # Route: Unique Visitors
+    # GET /stats/uniques?from=YYYY-MM-DD&to=YYYY-MM-DD[&graffiti=<id>]
+    # Estimated distinct users over the date range (UTC days, inclusive;
+    # both default to today), overall or for one graffiti, plus the
+    # estimate for each day.
+    # -----------------------------------------------------------------
+    def unique_visitors():
+        try:
+            end = date.fromisoformat(request.args["to"]) if "to" in request.args else utc_today()
+            start = date.fromisoformat(request.args["from"]) if "from" in request.args else end
+        except ValueError:
+            return jsonify({"error": "Dates must be YYYY-MM-DD."}), 400
+        if start > end or (end - start).days >= MAX_RANGE_DAYS:
+            return jsonify({"error": f"'from' must not be after 'to' and the range is limited "
+                                     f"to {MAX_RANGE_DAYS} days."}), 400
+        return jsonify(counter_for_request().count(start, end, request.args.get("graffiti"))), 200
+
+    for prefix in ('', '/sites/<site_id>'):
+        app.add_url_rule(prefix + '/stats/uniques', 'unique_visitors',
+                         unique_visitors, methods=['GET'])
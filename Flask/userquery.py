@@ -0,0 +1,155 @@
+# userquery.py
+
+# User lookups for support staff:
+#   GET /admin/users   (admin token required; also under /sites/<site_id>)
+# Query parameters:
+#   completed=true|false       – completion state
+#   scanned=<graffiti id>      – users who scanned it (repeat for "all of")
+#   created_after, created_before
+#                              – ISO 8601 registration time bounds
+#   order=asc|desc             – by registration time (default asc)
+#   fields=user_id,scanned,... – projection (default: every field below)
+#   limit=N                    – page size (default 50, at most 500)
+#   cursor=<next>              – continue after the previous page
+#
+# Pages use keyset (seek) pagination on (created_at, _id): the cursor
+# holds the last user's sort key and the next page starts right after
+# it, so every page is one range scan of the
+#   (created_at, _id), (completed, created_at, _id) or
+#   (scanned, created_at, _id)
+# index however deep it is, instead of skipping over all earlier users.
+# scanned is an array, so the last one is multikey; with several
+# scanned values the scan follows one of them and filters on the rest.
+# Each page is fetched in a single batch of limit + 1 documents; the
+# extra one only tells whether there is a next page.
+#
+# Users registered before created_at was tracked sort first (asc) or
+# last (desc).
+import base64
+from datetime import datetime, timezone
+
+from bson import json_util
+from flask import g, jsonify, request
+
+from admin import admin_required
+
+FIELDS = ("user_id", "scanned", "completed", "created_at", "last_seen")
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def ensure_indexes(users_col):
+    users_col.create_index([("created_at", 1), ("_id", 1)])
+    users_col.create_index([("completed", 1), ("created_at", 1), ("_id", 1)])
+    users_col.create_index([("scanned", 1), ("created_at", 1), ("_id", 1)])
+
+
+def encode_cursor(doc):
+    raw = json_util.dumps({"v": doc.get("created_at"), "id": doc["_id"]})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(text):
+    padded = text + "=" * (-len(text) % 4)
+    value = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    return value["v"], value["id"]
+
+
+# -------------------------------------------------------------------
+# Seek condition: everything strictly after (value, _id) in sort order.
+# Missing created_at sorts before every date, and range operators never
+# match it, so it needs its own branch.
+# -------------------------------------------------------------------
+def after(value, last_id, descending):
+    if not descending:
+        if value is None:
+            return {"$or": [{"created_at": None, "_id": {"$gt": last_id}},
+                            {"created_at": {"$type": "date"}}]}
+        return {"$or": [{"created_at": {"$gt": value}},
+                        {"created_at": value, "_id": {"$gt": last_id}}]}
+    if value is None:
+        return {"created_at": None, "_id": {"$lt": last_id}}
+    return {"$or": [{"created_at": {"$lt": value}},
+                    {"created_at": value, "_id": {"$lt": last_id}},
+                    {"created_at": None}]}
+
+
+def _parse_bool(text):
+    if text.lower() in ("true", "1", "yes"):
+        return True
+    if text.lower() in ("false", "0", "no"):
+        return False
+    raise ValueError(f"Invalid boolean {text!r}")
+
+
+def _parse_time(text):
+    value = datetime.fromisoformat(text)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def build_query(args):
+    query = {}
+    if "completed" in args:
+        query["completed"] = _parse_bool(args["completed"])
+    scanned = args.getlist("scanned")
+    if scanned:
+        query["scanned"] = {"$all": scanned}
+    created = {}
+    if "created_after" in args:
+        created["$gt"] = _parse_time(args["created_after"])
+    if "created_before" in args:
+        created["$lt"] = _parse_time(args["created_before"])
+    if created:
+        query["created_at"] = created
+    return query
+
+
+def _present(doc, fields):
+    out = {}
+    for field in fields:
+        value = doc.get(field)
+        out[field] = value.isoformat() if isinstance(value, datetime) else value
+    return out
+
+
+def init_app(app):
+    # -----------------------------------------------------------------
+    # Route: Admin User Query
+    # GET /admin/users
+    # -----------------------------------------------------------------
+    @admin_required
+    def admin_users():
+        args = request.args
+        try:
+            query = build_query(args)
+            fields = [f for f in args.get("fields", ",".join(FIELDS)).split(",") if f]
+            if not fields or any(f not in FIELDS for f in fields):
+                raise ValueError(f"fields must be a subset of {', '.join(FIELDS)}")
+            limit = int(args.get("limit", DEFAULT_LIMIT))
+            if not 0 < limit <= MAX_LIMIT:
+                raise ValueError(f"limit must be in 1..{MAX_LIMIT}")
+            descending = args.get("order", "asc").lower() == "desc"
+            if "cursor" in args:
+                query = {"$and": [query, after(*decode_cursor(args["cursor"]), descending)]}
+        except (ValueError, KeyError, TypeError) as exc:
+            return jsonify({"error": str(exc) or "Invalid query."}), 400
+
+        direction = -1 if descending else 1
+        projection = {field: 1 for field in fields}
+        projection["created_at"] = 1   # always needed for the cursor
+        docs = list(
+            g.site.col("users", "admin")
+            .find(query, projection)
+            .sort([("created_at", direction), ("_id", direction)])
+            .limit(limit + 1)
+            .batch_size(limit + 1)
+        )
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        return jsonify({
+            "users": [_present(doc, fields) for doc in docs],
+            "next": encode_cursor(docs[-1]) if has_more else None,
+        }), 200
+
+    for prefix in ('', '/sites/<site_id>'):
+        app.add_url_rule(prefix + '/admin/users', 'admin_users', admin_users, methods=['GET'])